@@ -27,5 +27,6 @@
 
 # Start Wrye Bash -------------------------------------------------------------
 if __name__ == '__main__':
+    import sys
     from src import bash
-    bash.main()
+    sys.exit(bash.main())
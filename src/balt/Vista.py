@@ -51,7 +51,6 @@
 from ctypes import *
 import ctypes.wintypes as wintypes
 import winreg
-import subprocess
 import platform
 import os
 
@@ -78,6 +77,7 @@ def StartURL(url):
         value = winreg.EnumValue(key, 0)
         cmd = value[1]
         cmd = cmd.replace('%1', url)
+        import subprocess
         subprocess.Popen(cmd)
     except WindowsError:
         # Regestry failed, fallback to Python standard method
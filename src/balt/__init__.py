@@ -23,5 +23,30 @@
 """The balt package implements commong basic UI elements"""
 
 
-#--Import sub-modules
-from .MessageDialogs import *
+# Imports ---------------------------------------------------------------------
+#--Standard
+import sys
+import importlib
+
+
+#--Sub-modules: MessageDialogs needs wx, and Vista loads the TaskDialog dll,
+#  so they aren't imported until one of the dialogs (balt.ShowError, etc) is
+#  first used.
+_submodules = ('MessageDialogs', 'Vista')
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    if not name.startswith('_'):
+        MessageDialogs = importlib.import_module('.MessageDialogs', __name__)
+        if hasattr(MessageDialogs, name):
+            value = globals()[name] = getattr(MessageDialogs, name)
+            return value
+    raise AttributeError('module %r has no attribute %r'
+                         % (__name__, name))
+
+
+if sys.version_info < (3, 7):
+    # No module __getattr__, import them now
+    from .MessageDialogs import *
@@ -46,4 +46,33 @@ def parse():
                         action='store_true',
                         default=False,
                         help='enable portable mode')
+    parser.add_argument('--no-optimize',
+                        dest='optimize',
+                        action='store_false',
+                        default=True,
+                        help='disable bytecode optimizations')
+    parser.add_argument('--path-stats',
+                        dest='pathStats',
+                        metavar='FILE',
+                        default=None,
+                        help='record statistics about file operations, '
+                             'written to FILE on exit (JSON if FILE ends '
+                             'with .json, otherwise a text report)')
+    parser.add_argument('--trace-startup',
+                        dest='traceStartup',
+                        metavar='FILE',
+                        nargs='?',
+                        const='-',
+                        default=None,
+                        help='time each phase of startup and the modules '
+                             'imported, written to FILE (JSON if FILE ends '
+                             'with .json), or the console if no FILE')
+    parser.add_argument('--startup-budget',
+                        dest='startupBudget',
+                        metavar='SECONDS',
+                        type=float,
+                        default=1.0,
+                        help='with --trace-startup, report if startup takes '
+                             'longer than this, and exit with status 1 '
+                             '(default: %(default)s)')
     bass.opts,extra = parser.parse_known_args()
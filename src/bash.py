@@ -27,6 +27,7 @@
 #--Standard
 import os
 import sys
+import atexit
 import builtins
 import traceback
 import warnings
@@ -34,6 +35,7 @@ import warnings
 #--Local
 from . import barg
 from . import bass
+from .bolt.Startup import Tracer
 
 
 # Install dummy translation function, so it can be used before translations are
@@ -121,13 +123,30 @@ def main():
     warnings.filterwarnings(
         'ignore',
         'wxPython/wxWidgets release number mismatch')
+    #--Time each phase of startup, reported with --trace-startup
+    tracer = Tracer()
+    status = 0
     try:
         #--Parse command line
+        tracer.begin('parse arguments')
         barg.parse()
+        if bass.opts.traceStartup:
+            tracer.traceImports()
+        if not bass.opts.optimize:
+            # Has to be before any optimized modules are imported
+            from .bolt import Optimize
+            Optimize.enabled = False
+        if bass.opts.pathStats:
+            from .bolt import Instrument
+            Instrument.enable()
+            atexit.register(Instrument.dump,
+                            os.path.abspath(bass.opts.pathStats))
         #--Initialize directories
+        tracer.begin('init dirs')
         from . import dirs
         dirs.InitDirs()
         #--Setup translations
+        tracer.begin('translations')
         try:
             from .bolt import Translations
             Translations.Install(pathRead=bass.dirs['l10n'],
@@ -138,12 +157,15 @@ def main():
             # TODO: use logging to print
             pass
         #--Check for dependencies
+        tracer.begin('verify requirements')
         if not VerifyRequirements():
             return
         #--Start wxApp
+        tracer.begin('start wx')
         import wx
         app = wx.App()
         #--Test for single instance
+        tracer.begin('single instance check')
         from .bolt import OneInstanceChecker
         if bass.opts.portable:
             oicDir = None # Use defalt
@@ -154,13 +176,22 @@ def main():
         del OneInstanceChecker
         #--Run the app!
         #  For now we're just using a dummy frame until we flesh this out
+        tracer.begin('main frame')
         frame = wx.Frame(None, wx.ID_ANY, _('Haha!'))
         frame.Show()
         if hasattr(sys, 'frozen'):
             frame.SetIcon(wx.Icon(sys.executable, wx.BITMAP_TYPE_ICO))
         else:
             frame.SetIcon(wx.Icon('bash.ico'))
+        tracer.end()
+        if bass.opts.traceStartup:
+            tracer.stopImports()
+            tracer.write(bass.opts.traceStartup, bass.opts.startupBudget)
+            if tracer.overBudget(bass.opts.startupBudget):
+                # Exit with an error, so scripts checking the budget fail
+                status = 1
         app.MainLoop()
+        return status
     except Exception as e:
         #--Something bad happened, try to show it in GUI mode.
         import io
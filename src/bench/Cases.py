@@ -0,0 +1,558 @@
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software; you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 2 of the License, or (at your option)
+#  any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful, but WITHOUT ANY
+#  WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#  details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  Wrye Bash; if not, write to the Free Software Foundation, Inc.,
+#  59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye
+#
+# =============================================================================
+
+
+"""This module contains the benchmarks.  Where an operation was rewritten
+   for speed, the old way of doing it is timed alongside as 'reference', so
+   the gain can be seen on any machine."""
+
+
+# Imports ---------------------------------------------------------------------
+#--Standard
+import os
+import sys
+import json
+import math
+import time
+import pickle
+import shutil
+import binascii
+import threading
+import subprocess
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+#--Local
+from . import benchmark, ROOT
+from . import Trees
+from ..bolt import Path as P
+from ..bolt.Path import GPath, GPathMany, PathUnion
+from ..bolt.Overlay import Overlay
+
+
+def _child(code, *args):
+    """Runs code in a new Python process (from the directory containing
+       src), and returns what it printed, decoded from JSON."""
+    output = subprocess.check_output(
+        [sys.executable, '-c', code] + [str(x) for x in args], cwd=ROOT,
+        universal_newlines=True)
+    return json.loads(output)
+
+
+def _peak_alloc(func):
+    """Returns the peak memory allocated by Python objects while running
+       func."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+#--GPath -----------------------------------------------------------------------
+@benchmark('gpath')
+def gpath(ctx):
+    """GPath interning: lookups of existing Paths, creating new ones, and
+       GPathMany."""
+    count = ctx.scaled(100000)
+    names = ['/mods/Mod %03d/meshes/file%06d.nif' % (x % 50, x)
+             for x in range(count)]
+    others = [name.replace('/meshes/', '/textures/') for name in names]
+    keep = [GPath(name) for name in names]
+    ctx.time('hit', lambda: [GPath(name) for name in names])
+    # Nothing holds on to these, so each run creates them again
+    ctx.time('miss', lambda: [GPath(name) for name in others])
+    base = '/mods/Mod 000/meshes'
+    leaves = ['file%06d.nif' % x for x in range(count)]
+    ctx.time('many', lambda: GPathMany(leaves, base))
+    ctx.time('manyReference',
+             lambda: [GPath(os.path.join(base, x)) for x in leaves])
+    ctx.note('names', count)
+    del keep
+
+
+@benchmark('gpath_threads')
+def gpath_threads(ctx):
+    """GPath called from 1 to 16 threads at once, half of the names already
+       interned."""
+    count = ctx.scaled(100000)
+    names = ['/mods/Mod %03d/file%06d.dds' % (x % 50, x)
+             for x in range(count)]
+    keep = [GPath(name) for name in names[::2]]
+
+    def work(chunk):
+        for name in chunk:
+            GPath(name)
+
+    for threads in (1, 2, 4, 8, 16):
+        chunks = [names[x::threads] for x in range(threads)]
+
+        def run():
+            workers = [threading.Thread(target=work, args=(chunk,))
+                       for chunk in chunks]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        ctx.time('threads%02d' % threads, run)
+    del keep
+
+
+@benchmark('gpath_stress')
+def gpath_stress(ctx):
+    """Stress test: 16 threads interning the same new names at once, with
+       thread switches forced as often as possible.  Fails unless every
+       thread got the identical Path object for each name."""
+    threads = 16
+    count = ctx.scaled(20000)
+    runs = []
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for run in range(ctx.repeat):
+            names = ['/stress/%d/Mod %03d/file%06d.nif' % (run, x % 100, x)
+                     for x in range(count)]
+            # Half the threads use unnormalized forms of the same names
+            unnormalized = [name.replace('/file', '/./file') for name in names]
+            results = [None] * threads
+            barrier = threading.Barrier(threads)
+
+            def work(index):
+                chunk = unnormalized if index % 2 else names
+                barrier.wait()
+                results[index] = [GPath(name) for name in chunk]
+
+            workers = [threading.Thread(target=work, args=(x,))
+                       for x in range(threads)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            runs.append(time.perf_counter() - start)
+            first = results[0]
+            differ = sum(1 for result in results[1:]
+                         for a, b in zip(first, result) if a is not b)
+            ctx.check(differ == 0, 'run %d: %d GPaths were not the identical '
+                      'object in every thread' % (run, differ))
+            ctx.check(all(GPath(name) is path
+                          for name, path in zip(names, first)),
+                      'run %d: GPath returned a different object after the '
+                      'threads finished' % run)
+    finally:
+        sys.setswitchinterval(interval)
+    ctx.record('time', runs)
+    ctx.note('names', count)
+
+
+class _EagerPath(P.Path):
+    """Path as it was before __setstate__ was made lazy: every slot is
+       filled in when the Path is made."""
+    __slots__ = ()
+
+    def __setstate__(self, norm):
+        self._s = norm
+        self._cs = os.path.normcase(self._s)
+        self._sroot, self._ext = os.path.splitext(self._s)
+        self._csroot, self._cext = os.path.splitext(self._cs)
+        self._shead, self._stail = os.path.split(self._s)
+        self._sbody = os.path.basename(self._sroot)
+        self._csbody = os.path.basename(self._csroot)
+
+
+def _use(paths):
+    """Uses a few attributes of each path, the first time for new Paths."""
+    return [(x.cext, x.stail, x.head) for x in paths]
+
+
+@benchmark('setstate')
+def setstate(ctx):
+    """Pickling and unpickling lists of Paths (Path.__setstate__)."""
+    names = ['file%06d.esp' % x for x in range(ctx.scaled(50000))]
+    paths = GPathMany(names, '/mods/Mod 000')
+    data = pickle.dumps(paths, pickle.HIGHEST_PROTOCOL)
+    eager = pickle.dumps([_EagerPath(x) for x in paths],
+                         pickle.HIGHEST_PROTOCOL)
+    ctx.time('dumps', lambda: pickle.dumps(paths, pickle.HIGHEST_PROTOCOL))
+    ctx.time('loads', lambda: pickle.loads(data))
+    ctx.time('reference', lambda: pickle.loads(eager))
+    ctx.time('loadsAttributes', lambda: _use(pickle.loads(data)))
+    ctx.time('referenceAttributes', lambda: _use(pickle.loads(eager)))
+    ctx.note('bytes', len(data))
+
+
+#--CRC ------------------------------------------------------------------------
+def _reference_crc(path):
+    """How Path.crc used to work: a new bytes object for each chunk read."""
+    size = os.path.getsize(path)
+    crc = 0
+    crc32 = binascii.crc32
+    with open(path, 'rb') as ins:
+        insTell = ins.tell
+        insRead = ins.read
+        while insTell() < size:
+            crc = crc32(insRead(2097152), crc)
+    return crc & 0xFFFFFFFF
+
+
+_RSS_CODE = '''
+import sys, json, resource
+from src.bench.Cases import _reference_crc
+from src.bolt import Path as P
+how, path = sys.argv[1:]
+if how == 'crc':
+    P.crcCache.clear()
+    P.GPath(path).crc
+elif how == 'reference':
+    _reference_crc(path)
+# ru_maxrss includes the parent's usage from before exec, so prefer this
+try:
+    with open('/proc/self/status') as ins:
+        peak = [int(line.split()[1]) for line in ins
+                if line.startswith('VmHWM:')][0]
+except (OSError, IndexError):
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps(peak))
+'''
+
+
+@benchmark('crc')
+def crc(ctx):
+    """Path.crc of a mod tree without and with the CRC cache, crc_many, and
+       a large (memory mapped) file, against the old read loop."""
+    root = ctx.path('mods')
+    total = Trees.makeModTree(root, ctx.scaled(2000), maxSize=65536)
+    files = [entry.path for entry in GPath(root).scan() if not entry.isdir]
+    clear = P.crcCache.clear
+
+    def crcs():
+        for path in files:
+            path.crc
+    ctx.time('cold', crcs, setup=clear)
+    ctx.time('warm', crcs)
+    ctx.time('many', lambda: P.crc_many(files), setup=clear)
+    ctx.time('reference', lambda: [_reference_crc(path.s) for path in files])
+    # Large files
+    medium = ctx.path('medium.bsa')
+    Trees.makeFile(medium, 16777216)
+    large = ctx.path('large.bsa')
+    Trees.makeFile(large, 83886080)
+    mediumPath, largePath = GPath(medium), GPath(large)
+    ctx.time('medium', lambda: mediumPath.crc, setup=clear)
+    ctx.time('mediumReference', lambda: _reference_crc(medium))
+    ctx.time('large', lambda: largePath.crc, setup=clear)
+    ctx.time('largeReference', lambda: _reference_crc(large))
+    clear()
+    ctx.note('bytes', total)
+    for name, path, func in (('medium', mediumPath, _reference_crc),
+                             ('large', largePath, _reference_crc)):
+        clear()
+        ctx.note('%sPeakAlloc' % name, _peak_alloc(lambda: path.crc))
+        ctx.note('%sPeakAllocReference' % name,
+                 _peak_alloc(lambda: func(path.s)))
+    clear()
+    if resource:
+        # Peak RSS needs a fresh process each
+        base = _child(_RSS_CODE, 'none', large)
+        for how in ('crc', 'reference'):
+            rss = _child(_RSS_CODE, how, large)
+            ctx.note('largePeakRSSKB' + ('Reference' if how == 'reference'
+                                         else ''), rss - base)
+
+
+#--Scanning -------------------------------------------------------------------
+@benchmark('lazy')
+def lazy(ctx):
+    """Making Paths for every file of a large tree (100000 files at scale 1),
+       and then using a few of their attributes."""
+    root = ctx.path('flat')
+    Trees.makeFlatTree(root, ctx.scaled(100000))
+    top = GPath(root)
+    ctx.time('scan', lambda: [entry.path for entry in top.scan()],
+             repeat=min(ctx.repeat, 3))
+    ctx.time('walk', lambda: [files for dirs, subs, files in top.walk()],
+             repeat=min(ctx.repeat, 3))
+    ctx.time('reference',
+             lambda: [GPath(os.path.join(dirs, name))
+                      for dirs, subs, files in os.walk(root)
+                      for name in files],
+             repeat=min(ctx.repeat, 3))
+    names = [entry.path.s for entry in top.scan() if not entry.isdir]
+    ctx.time('construct', lambda: [P.Path(x) for x in names])
+    ctx.time('constructReference', lambda: [_EagerPath(x) for x in names])
+    ctx.time('attributes', lambda: _use([P.Path(x) for x in names]))
+    ctx.time('attributesReference',
+             lambda: _use([_EagerPath(x) for x in names]))
+    del names
+    ctx.note('memory', _peak_alloc(
+        lambda: [entry.path for entry in top.scan()]))
+
+
+@benchmark('size')
+def size(ctx):
+    """Path.size of a mod tree: plain, with threads, and cached in a
+       DirCache, against the old os.walk/getsize way."""
+    root = ctx.path('mods')
+    total = Trees.makeModTree(root, ctx.scaled(10000), maxSize=4096)
+    top = GPath(root)
+    cache = P.DirCache()
+    ctx.time('size', lambda: top.size)
+    ctx.time('threads', lambda: top.getsize(threads=8))
+    ctx.time('cached', lambda: top.getsize(cache=cache))
+    ctx.time('reference',
+             lambda: sum(os.path.getsize(os.path.join(dirs, name))
+                         for dirs, subs, files in os.walk(root)
+                         for name in files))
+    ctx.check(top.size == total,
+              'size gave %d bytes, expected %d' % (top.size, total))
+    ctx.check(top.getsize(threads=8) == total,
+              'getsize(threads=8) gave %d bytes, expected %d'
+              % (top.getsize(threads=8), total))
+    ctx.check(top.getsize(cache=cache) == total,
+              'getsize(cache=...) gave %d bytes, expected %d'
+              % (top.getsize(cache=cache), total))
+
+
+#--Copying and removing -------------------------------------------------------
+@benchmark('copy')
+def copy(ctx):
+    """Path.copy of a mod tree (10000 files at scale 1, up to 16KB each at
+       size scale 1), with copies and hard links, against shutil.copytree."""
+    root = ctx.path('mods')
+    total = Trees.makeModTree(root, ctx.scaled(10000),
+                              maxSize=ctx.sized(16384))
+    dest = ctx.path('copy')
+    top = GPath(root)
+    repeat = min(ctx.repeat, 3)
+
+    def clean():
+        shutil.rmtree(dest, ignore_errors=True)
+    ctx.time('copy', lambda: top.copy(dest), setup=clean, repeat=repeat)
+    ctx.time('hardlink', lambda: top.copy(dest, hardlink=True),
+             setup=clean, repeat=repeat)
+    ctx.time('reference', lambda: shutil.copytree(root, dest), setup=clean,
+             repeat=repeat)
+    clean()
+    ctx.note('bytes', total)
+
+
+def _reference_prune(top):
+    """How Path.remove(emptyOnly=True) used to work."""
+    for root, dirs, files in os.walk(top):
+        if not files and not dirs:
+            os.removedirs(root)
+    if not os.path.exists(top):
+        os.makedirs(top)
+        os.rmdir(top)
+
+
+@benchmark('prune')
+def prune(ctx):
+    """Path.remove(emptyOnly=True) of a deep tree of mostly empty
+       directories, against the old repeated os.removedirs."""
+    # os.removedirs goes up to the first non-empty parent, so keep one
+    keep = ctx.path('keep')
+    os.makedirs(keep)
+    Trees.makeFile(os.path.join(keep, 'keep.txt'), 1)
+    top = os.path.join(keep, 'sparse')
+    depth = max(1, int(round(math.log(ctx.scaled(6561), 3))))
+    leaves = [0]
+
+    def build():
+        shutil.rmtree(top, ignore_errors=True)
+        leaves[0] = Trees.makeSparseTree(top, depth, 3, 3 ** depth // 100)
+    ctx.time('prune', lambda: GPath(top).remove(emptyOnly=True),
+             setup=build)
+    ctx.time('reference', lambda: _reference_prune(top), setup=build)
+    ctx.note('leaves', leaves[0])
+
+
+@benchmark('remove')
+def remove(ctx):
+    """Path.remove of a mod tree, in the foreground and background, against
+       shutil.rmtree."""
+    template = ctx.path('template')
+    Trees.makeModTree(template, ctx.scaled(5000), maxSize=1024)
+    target = ctx.path('target')
+
+    def build():
+        P.waitForRemovals()
+        shutil.rmtree(target, ignore_errors=True)
+        GPath(template).copy(target, hardlink=True)
+    ctx.time('remove', lambda: GPath(target).remove(), setup=build)
+    ctx.time('background', lambda: GPath(target).remove(background=True),
+             setup=build)
+    ctx.time('reference', lambda: shutil.rmtree(target), setup=build)
+    P.waitForRemovals()
+
+
+#--Unions ---------------------------------------------------------------------
+def _reference_join(pathUnion, *args):
+    """PathUnion.join as it was, searching every directory of the union."""
+    norms = [P.getNorm(x) for x in args]
+    match = pathUnion._search(norms)
+    if match:
+        return GPath(match)
+    return pathUnion.dirs[0].join(*norms)
+
+
+@benchmark('union')
+def union(ctx):
+    """PathUnion.join and Overlay over 8 layers, against the old search of
+       every layer."""
+    dirs, names = Trees.makeLayers(ctx.path('layers'), 8, ctx.scaled(2000))
+    for mode, label in ((PathUnion.MODE_ORDER, 'order'),
+                        (PathUnion.MODE_TIMESTAMP, 'timestamp')):
+        pathUnion = PathUnion(*dirs, mode=mode)
+        ctx.time(label + 'Join',
+                 lambda: [pathUnion.join(name) for name in names])
+        ctx.time(label + 'Reference',
+                 lambda: [_reference_join(pathUnion, name)
+                          for name in names])
+        ctx.time(label + 'Overlay', lambda: Overlay(*dirs, mode=mode),
+                 repeat=min(ctx.repeat, 3))
+        overlay = Overlay(*dirs, mode=mode)
+        ctx.time(label + 'OverlayJoin',
+                 lambda: [overlay.join(name) for name in names])
+        ctx.time(label + 'Conflicts', overlay.conflicts)
+    ctx.note('files', len(names))
+
+
+#--Optimize -------------------------------------------------------------------
+_OPTIMIZE_CODE = '''
+import sys, json, timeit
+from src.bolt import Optimize
+Optimize.enabled = sys.argv[1] == '1'
+from src.bolt import Path as P
+base = P.GPath(sys.argv[2])
+names = ['Mod %03d' % x for x in range(50)]
+def work():
+    for name in names:
+        path = base.join(name, 'meshes', 'file.nif')
+        path.cext, path.head, path.stail, path.body, path.isabs
+        P.GPath(path.s)
+print(json.dumps([x / 200 for x in
+                  timeit.repeat(work, number=200, repeat=int(sys.argv[3]))]))
+'''
+
+
+@benchmark('optimize')
+def optimize(ctx):
+    """Path methods with bolt.Optimize's constant binding on and off (run in
+       new processes, since it happens at import)."""
+    times = {}
+    for flag, label in (('1', 'enabled'), ('0', 'disabled')):
+        runs = _child(_OPTIMIZE_CODE, flag, ctx.root, ctx.repeat)
+        ctx.record(label, runs)
+        times[label] = min(runs)
+    ctx.note('speedup', times['disabled'] / times['enabled'])
+
+
+#--Import time -----------------------------------------------------------------
+# Modules timed by the importtime benchmark, each imported in a new process
+_IMPORT_MODULES = ('src.bolt', 'src.bolt.Path', 'src.bolt.Overlay',
+                   'src.balt', 'src.bash')
+# Slow to import modules, which bolt and balt only import when first needed
+_HEAVY_MODULES = ('shutil', 'subprocess', 'tempfile', 'pickle', 'random',
+                  'concurrent.futures', 'logging', 'filecmp', 'ctypes', 'dis',
+                  'wx')
+# Modules that must not import any of those, the benchmark fails if they do
+_LIGHT_MODULES = ('src.bolt', 'src.bolt.Path', 'src.bolt.Overlay',
+                  'src.balt')
+
+
+def _parse_importtime(text):
+    """Parses the output of python -X importtime into a list of (name, self
+       time, cumulative time, depth), with times in seconds.  depth is 0 for
+       modules imported directly, 1 for the ones they imported, and so on."""
+    imports = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # The header, or something else printed to stderr
+            continue
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        # One space after the '|', then two per level
+        depth = (len(name) - len(stripped) - 1) // 2
+        imports.append((stripped, int(fields[0]) / 1e6, int(fields[1]) / 1e6,
+                        depth))
+    return imports
+
+
+def _import_child(module):
+    """Imports module in a new Python process with -X importtime, and returns
+       the parsed timings."""
+    env = dict(os.environ)
+    # Time loading from the cached bytecode, like a normal start up
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    proc = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    output = proc.communicate()[1]
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args,
+                                            output)
+    return _parse_importtime(output)
+
+
+@benchmark('importtime')
+def importtime(ctx):
+    """Time to import the bolt and balt packages, and the modules using them,
+       from python -X importtime in new processes.  Also notes which slow
+       modules each pulls in, and the slowest of its imports.  Fails if
+       bolt, bolt.Path, bolt.Overlay or balt pull in any of them."""
+    if sys.version_info < (3, 7):
+        ctx.note('skipped', 'python -X importtime needs Python 3.7+')
+        return
+    for module in _IMPORT_MODULES:
+        # Untimed, writes any missing bytecode caches
+        _import_child(module)
+        runs = []
+        for x in range(ctx.repeat):
+            imports = _import_child(module)
+            end = [x[0] for x in imports].index(module)
+            runs.append(imports[end][2])
+        ctx.record(module, runs)
+        # What module imported is listed just before it, one level deeper
+        start = end
+        while start and imports[start - 1][3] > imports[end][3]:
+            start -= 1
+        imports = imports[start:end + 1]
+        names = {name for name, own, took, depth in imports}
+        heavy = [name for name in _HEAVY_MODULES if name in names]
+        slowest = sorted(imports, key=lambda x: x[1], reverse=True)[:5]
+        ctx.note(module, {
+            'modules': len(imports),
+            'heavy': heavy,
+            'slowest': [[name, own] for name, own, took, depth in slowest],
+            })
+        if module in _LIGHT_MODULES:
+            ctx.check(not heavy, 'importing %s loads %s' % (
+                module, ', '.join(heavy)))
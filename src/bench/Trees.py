@@ -0,0 +1,129 @@
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software; you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 2 of the License, or (at your option)
+#  any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful, but WITHOUT ANY
+#  WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#  details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  Wrye Bash; if not, write to the Free Software Foundation, Inc.,
+#  59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye
+#
+# =============================================================================
+
+
+"""This module builds synthetic directory trees for the benchmarks.  The
+   layout, file sizes and contents are chosen by seeded random generators, so
+   the same arguments always give the same tree."""
+
+
+# Imports ---------------------------------------------------------------------
+#--Standard
+import os
+import random
+
+
+# Subdirectories and extensions found in a typical mod
+_MOD_DIRS = (('meshes', '.nif'), ('meshes/armor', '.nif'),
+             ('meshes/clutter', '.nif'), ('textures', '.dds'),
+             ('textures/armor', '.dds'), ('textures/landscape', '.dds'),
+             ('sound/fx', '.wav'), ('scripts', '.pex'),
+             ('interface', '.swf'),
+             )
+# File contents are cut from this.  It's seeded so that every run (and
+# every machine) gets the same contents.
+_BLOCK = random.Random(0).getrandbits(65536 * 8).to_bytes(65536, 'little')
+
+
+def makeFile(path, size):
+    """Creates file path with size bytes of (fixed) random contents."""
+    with open(path, 'wb') as out:
+        while size > 0:
+            chunk = _BLOCK[:size]
+            out.write(chunk)
+            size -= len(chunk)
+
+
+def makeModTree(root, files, mods=None, maxSize=16384, seed=0):
+    """Creates a Mods folder under root: mods directories ('Mod 000', ...)
+       with files spread over the usual meshes, textures, etc subdirectories,
+       plus a plugin in each.  File sizes are random up to maxSize.  Returns
+       the total number of bytes written."""
+    rng = random.Random(seed)
+    mods = mods or max(1, files // 200)
+    total = 0
+    made = set()
+    for index in range(files):
+        mod = 'Mod %03d' % (index % mods)
+        subdir, ext = rng.choice(_MOD_DIRS)
+        dirname = os.path.join(root, mod, subdir)
+        if dirname not in made:
+            os.makedirs(dirname, exist_ok=True)
+            made.add(dirname)
+        if index < mods:
+            name = os.path.join(root, mod, '%s.esp' % mod)
+        else:
+            name = os.path.join(dirname, 'file%05d%s' % (index, ext))
+        size = rng.randint(0, maxSize)
+        makeFile(name, size)
+        total += size
+    return total
+
+
+def makeFlatTree(root, files, perDir=1000):
+    """Creates files empty files under root, perDir to a directory."""
+    for index in range(files):
+        if not index % perDir:
+            dirname = os.path.join(root, 'dir%04d' % (index // perDir))
+            os.makedirs(dirname, exist_ok=True)
+        open(os.path.join(dirname, 'file%06d.dds' % index), 'wb').close()
+
+
+def makeSparseTree(root, depth, breadth, files=0, seed=0):
+    """Creates a tree of directories under root, depth levels deep with
+       breadth subdirectories each, where only files randomly chosen leaf
+       directories hold a file.  Everything else is empty directories, for
+       testing the pruning of empty directories."""
+    rng = random.Random(seed)
+    leaves = [root]
+    for level in range(depth):
+        leaves = [os.path.join(parent, 'd%d' % index) for parent in leaves
+                  for index in range(breadth)]
+    for leaf in leaves:
+        os.makedirs(leaf, exist_ok=True)
+    for leaf in rng.sample(leaves, min(files, len(leaves))):
+        makeFile(os.path.join(leaf, 'keep.txt'), 16)
+    return len(leaves)
+
+
+def makeLayers(root, layers, files, overlap=0.5, seed=0):
+    """Creates layers directories under root (for PathUnion and Overlay),
+       each with files files.  overlap is the fraction of each layer's files
+       that other layers have too.  Returns the list of layer directories and
+       a list of all relative file names."""
+    rng = random.Random(seed)
+    shared = ['shared/%s/file%05d.nif' % (rng.choice('abcdefgh'), index)
+              for index in range(int(files * overlap))]
+    names = set(shared)
+    dirs = []
+    for layer in range(layers):
+        dirname = os.path.join(root, 'Layer %02d' % layer)
+        dirs.append(dirname)
+        own = ['layer%02d/%s/file%05d.dds' % (layer, rng.choice('abcd'), index)
+               for index in range(files - len(shared))]
+        names.update(own)
+        for name in shared + own:
+            path = os.path.join(dirname, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'wb').close()
+            stamp = rng.choice((1000000000, 1100000000, 1200000000))
+            os.utime(path, (stamp, stamp))
+    return dirs, sorted(names)
@@ -0,0 +1,209 @@
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software; you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 2 of the License, or (at your option)
+#  any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful, but WITHOUT ANY
+#  WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#  details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  Wrye Bash; if not, write to the Free Software Foundation, Inc.,
+#  59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye
+#
+# =============================================================================
+
+
+"""bench contains benchmarks for the bolt package.  Run them with:
+       python -m src.bench --help
+   from the directory containing src.  The benchmarks build synthetic mod
+   trees in a temporary directory (see Trees), time the bolt operations on
+   them (see Cases), and report the times as JSON, which can be saved as a
+   baseline to compare later runs against.  Some benchmarks also check
+   things (that threads get the same GPaths, etc), and a failed check fails
+   the run whatever the times."""
+
+
+# Imports ---------------------------------------------------------------------
+#--Standard
+import os
+import sys
+import gc
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import statistics
+
+
+# Directory containing the src package
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+#--Registered benchmarks, in the order they run: (name, function, doc)
+_benchmarks = []
+
+
+def benchmark(name):
+    """Decorator registering a function as the benchmark name.  The function
+       is called with a Context, and uses it to time things."""
+    def register(func):
+        _benchmarks.append((name, func, (func.__doc__ or '').strip()))
+        return func
+    return register
+
+
+def benchmarks():
+    """Returns a list of (name, description) of all benchmarks."""
+    from . import Cases
+    return [(name, ' '.join(doc.split())) for name, func, doc in _benchmarks]
+
+
+class Context(object):
+    """Passed to each benchmark.  Holds the settings of this run, a scratch
+       directory for the benchmark, and collects its results and failed
+       checks.
+         scale - multiplier for the number of files in the trees built.
+         repeat - number of times each timing is repeated.
+         sizeScale - multiplier for the size of the files in the trees
+             built."""
+
+    __slots__ = ('root', 'scale', 'repeat', 'sizeScale', 'metrics', 'notes',
+                 'failures')
+
+    def __init__(self, root, scale=1.0, repeat=5, sizeScale=1.0):
+        self.root = root
+        self.scale = scale
+        self.repeat = repeat
+        self.sizeScale = sizeScale
+        self.metrics = {}
+        self.notes = {}
+        self.failures = []
+
+    def scaled(self, count):
+        """Returns count adjusted by the scale, at least 1."""
+        return max(1, int(count * self.scale))
+
+    def sized(self, size):
+        """Returns a file size adjusted by the size scale, at least 1."""
+        return max(1, int(size * self.sizeScale))
+
+    def path(self, *names):
+        """Returns a path in the scratch directory."""
+        return os.path.join(self.root, *names)
+
+    def time(self, metric, func, number=1, setup=None, repeat=None):
+        """Times func, calling it number times in a row, repeat times.  setup
+           is called (untimed) before each repeat.  The time per call is
+           recorded as metric.  Returns the fastest."""
+        runs = []
+        for x in range(repeat or self.repeat):
+            if setup:
+                setup()
+            gc.collect()
+            start = time.perf_counter()
+            for y in range(number):
+                func()
+            runs.append((time.perf_counter() - start) / number)
+        self.record(metric, runs)
+        return min(runs)
+
+    def record(self, metric, runs):
+        """Records the times (in seconds) of runs timed some other way as
+           metric."""
+        self.metrics[metric] = {'min': min(runs),
+                                'median': statistics.median(runs),
+                                'runs': runs,
+                                }
+
+    def note(self, key, value):
+        """Records extra information (sizes, speedups, memory), which isn't
+           compared against the baseline."""
+        self.notes[key] = value
+
+    def check(self, condition, message):
+        """Records message as a failure if condition is false.  Returns
+           condition."""
+        if not condition:
+            self.failures.append(message)
+        return condition
+
+
+def environment():
+    """Returns a dictionary describing the machine and source being
+       benchmarked."""
+    from ..bolt import Optimize
+    env = {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+           'python': sys.version.split()[0],
+           'implementation': platform.python_implementation(),
+           'executable': sys.executable,
+           'platform': platform.platform(),
+           'machine': platform.machine(),
+           'cpus': os.cpu_count(),
+           'optimize': Optimize.enabled,
+           }
+    try:
+        env['commit'] = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        env['commit'] = None
+    return env
+
+
+def run(names=None, scale=1.0, repeat=5, tempDir=None, log=None,
+        sizeScale=1.0):
+    """Runs the benchmarks (all, or those named in names) and returns the
+       results as a dictionary ready to save as JSON.
+         tempDir - directory to build the trees in, defaults to the system
+             temp directory.
+         log - called with a message as each benchmark starts.
+         sizeScale - multiplier for the size of the files in the trees
+             built."""
+    from . import Cases
+    selected = [x for x in _benchmarks if not names or x[0] in names]
+    results = {'environment': environment(),
+               'config': {'scale': scale, 'repeat': repeat,
+                          'sizeScale': sizeScale},
+               'benchmarks': {},
+               }
+    for name, func, doc in selected:
+        if log:
+            log(name)
+        root = tempfile.mkdtemp(prefix='bench_%s_' % name, dir=tempDir)
+        ctx = Context(root, scale, repeat, sizeScale)
+        try:
+            func(ctx)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        results['benchmarks'][name] = {'metrics': ctx.metrics,
+                                       'notes': ctx.notes,
+                                       'failures': ctx.failures}
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    """Compares the fastest times of results to those in baseline.  Returns
+       a list of (benchmark, metric, baseline time, time, ratio, regressed),
+       where regressed is True if the time is more than threshold (a
+       fraction) slower."""
+    comparison = []
+    old = baseline.get('benchmarks', {})
+    for name, result in sorted(results['benchmarks'].items()):
+        oldMetrics = old.get(name, {}).get('metrics', {})
+        for metric, value in sorted(result['metrics'].items()):
+            if metric not in oldMetrics:
+                continue
+            base = oldMetrics[metric]['min']
+            current = value['min']
+            ratio = current / base if base else float('inf')
+            comparison.append((name, metric, base, current, ratio,
+                               ratio > 1 + threshold))
+    return comparison
@@ -0,0 +1,160 @@
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software; you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 2 of the License, or (at your option)
+#  any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful, but WITHOUT ANY
+#  WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#  details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  Wrye Bash; if not, write to the Free Software Foundation, Inc.,
+#  59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye
+#
+# =============================================================================
+
+
+"""Command line for running the benchmarks: python -m src.bench --help"""
+
+
+# Imports ---------------------------------------------------------------------
+#--Standard
+import sys
+import json
+import argparse
+
+#--Local
+from . import run, compare, benchmarks
+
+
+def parse(args=None):
+    """Parses the command line for the benchmark options."""
+    parser = argparse.ArgumentParser(
+        prog='python -m src.bench',
+        description='Benchmarks for the bolt package.  Results are written '
+                    'as JSON, and can be compared against a baseline.')
+    parser.add_argument('names',
+                        nargs='*',
+                        metavar='NAME',
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('-l', '--list',
+                        action='store_true',
+                        default=False,
+                        help='list the benchmarks and exit')
+    parser.add_argument('-s', '--scale',
+                        type=float,
+                        default=1.0,
+                        help='multiplier for the number of files in the '
+                             'trees built (default: %(default)s)')
+    parser.add_argument('-S', '--size-scale',
+                        dest='sizeScale',
+                        type=float,
+                        default=1.0,
+                        help='multiplier for the size of the files in the '
+                             'trees built.  The copy benchmark at -S 64 '
+                             'copies about 5GB (default: %(default)s)')
+    parser.add_argument('-r', '--repeat',
+                        type=int,
+                        default=5,
+                        help='times to repeat each timing '
+                             '(default: %(default)s)')
+    parser.add_argument('-o', '--output',
+                        metavar='FILE',
+                        default=None,
+                        help='write the results to FILE instead of stdout')
+    parser.add_argument('-b', '--baseline',
+                        metavar='FILE',
+                        default=None,
+                        help='compare the results to those in FILE')
+    parser.add_argument('--save-baseline',
+                        dest='saveBaseline',
+                        metavar='FILE',
+                        default=None,
+                        help='also save the results to FILE, as the new '
+                             'baseline')
+    parser.add_argument('-t', '--threshold',
+                        type=float,
+                        default=0.2,
+                        help='fraction slower than the baseline counted as '
+                             'a regression (default: %(default)s)')
+    parser.add_argument('--tmpdir',
+                        default=None,
+                        help='directory to build the trees in (default: the '
+                             'system temp directory)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    """Runs the benchmarks.  Returns 1 if any failed a check or regressed
+       against the baseline, otherwise 0."""
+    opts = parse(args)
+    known = benchmarks()
+    if opts.list:
+        for name, doc in known:
+            print('%-14s %s' % (name, doc))
+        return 0
+    unknown = set(opts.names) - set(name for name, doc in known)
+    if unknown:
+        sys.stderr.write('Unknown benchmarks: %s\n'
+                         % ', '.join(sorted(unknown)))
+        return 2
+
+    def log(name):
+        sys.stderr.write('Running %s...\n' % name)
+        sys.stderr.flush()
+    results = run(opts.names, opts.scale, opts.repeat, opts.tmpdir, log,
+                  opts.sizeScale)
+
+    status = 0
+    for name, result in sorted(results['benchmarks'].items()):
+        for failure in result['failures']:
+            sys.stderr.write('FAILED %s: %s\n' % (name, failure))
+            status = 1
+    if opts.baseline:
+        with open(opts.baseline) as ins:
+            baseline = json.load(ins)
+        if baseline.get('config') != results['config']:
+            sys.stderr.write('Warning: the baseline was run with different '
+                             'settings: %s\n' % baseline.get('config'))
+        comparison = compare(results, baseline, opts.threshold)
+        results['comparison'] = {
+            'baseline': opts.baseline,
+            'threshold': opts.threshold,
+            'metrics': [{'benchmark': name, 'metric': metric,
+                         'baseline': base, 'current': current,
+                         'ratio': ratio, 'regressed': regressed}
+                        for name, metric, base, current, ratio, regressed
+                        in comparison],
+            }
+        sys.stderr.write('%-30s %12s %12s %8s\n' % ('Metric', 'Baseline',
+                                                    'Current', 'Ratio'))
+        for name, metric, base, current, ratio, regressed in comparison:
+            sys.stderr.write('%-30s %12.6f %12.6f %8.2f%s\n' % (
+                name + '.' + metric, base, current, ratio,
+                '  REGRESSION' if regressed else ''))
+        regressions = sum(1 for x in comparison if x[-1])
+        if regressions:
+            sys.stderr.write('%d regressions beyond %d%%\n'
+                             % (regressions, opts.threshold * 100))
+            status = 1
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as out:
+            out.write(text)
+    else:
+        print(text)
+    if opts.saveBaseline:
+        with open(opts.saveBaseline, 'w') as out:
+            out.write(text)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
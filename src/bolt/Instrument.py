@@ -0,0 +1,273 @@
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software; you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 2 of the License, or (at your option)
+#  any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful, but WITHOUT ANY
+#  WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#  details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  Wrye Bash; if not, write to the Free Software Foundation, Inc.,
+#  59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye
+#
+# =============================================================================
+
+
+"""This module records statistics about the slow Path operations (crc, copy,
+   move, remove, walk, size) and GPath interning, to see where time goes.
+   Recording is off until enable is called: the Path methods are only
+   wrapped while it's on, so there's no cost at all otherwise."""
+
+
+# Imports ---------------------------------------------------------------------
+#--Standard
+import os
+import sys
+import time
+import json
+import random
+import threading
+
+#--Local
+from . import Path as _Path
+
+
+_MAX_SAMPLES = 10000    # Latencies kept per operation for percentiles
+
+# Operations recorded: name, Path attribute wrapped, and how to find the
+# number of bytes processed.  An int is the position of the callback
+# argument, which is called with the bytes processed so far.  'result' means
+# the return value, and 'iter' that the method is a generator, timed until
+# it's exhausted.
+_TARGETS = (('crc', '_crc', 1),
+            ('copy', 'copy', 2),
+            ('move', 'move', None),
+            ('remove', 'remove', None),
+            ('walk', 'walk', 'iter'),
+            ('size', 'getsize', 'result'),
+            )
+
+
+class OpStats(object):
+    """Statistics for one operation: number of calls, total time, bytes
+       processed, and a random sample of the call times for percentiles."""
+
+    __slots__ = ('name', 'calls', 'total', 'bytes', 'samples')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.bytes = 0
+        self.samples = []
+
+    def add(self, elapsed, size=0):
+        self.calls += 1
+        self.total += elapsed
+        self.bytes += size
+        if len(self.samples) < _MAX_SAMPLES:
+            self.samples.append(elapsed)
+        else:
+            # Reservoir sampling, every call has the same chance to be kept
+            index = random.randrange(self.calls)
+            if index < _MAX_SAMPLES:
+                self.samples[index] = elapsed
+
+    def percentile(self, pct):
+        """Returns the pct percentile of the call times, in seconds."""
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        index = max(0, int(round(pct / 100 * len(samples))) - 1)
+        return samples[min(index, len(samples) - 1)]
+
+    def toDict(self):
+        return {'calls': self.calls,
+                'total': self.total,
+                'mean': self.total / self.calls if self.calls else 0.0,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'max': max(self.samples) if self.samples else 0.0,
+                'bytes': self.bytes,
+                }
+
+
+#--Recording state, only changed under _lock
+_lock = threading.Lock()
+_stats = {}
+_originals = {}         # Path attribute -> unwrapped value, while enabled
+_started = [None]       # time.time() of enable/reset
+_gpathBase = [0, 0]     # GPath hits, misses at enable/reset
+
+
+def _record(name, elapsed, size=0):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = OpStats(name)
+        stats.add(elapsed, size or 0)
+
+
+class _Progress(object):
+    """Stands in for a progress callback, remembering the highest byte count
+       it was called with and passing it on to the real callback."""
+
+    __slots__ = ('callback', 'bytes')
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.bytes = 0
+
+    def __call__(self, size):
+        if size > self.bytes:
+            self.bytes = size
+        if self.callback:
+            self.callback(size)
+
+
+def _wrap(name, func, how):
+    """Returns a wrapper for func recording each call under name."""
+    clock = time.perf_counter
+    if how == 'iter':
+        def wrapper(*args, **kwds):
+            start = clock()
+            try:
+                yield from func(*args, **kwds)
+            finally:
+                _record(name, clock() - start)
+    elif how == 'result':
+        def wrapper(*args, **kwds):
+            start = clock()
+            result = func(*args, **kwds)
+            _record(name, clock() - start, result)
+            return result
+    elif isinstance(how, int):
+        def wrapper(*args, **kwds):
+            if len(args) > how:
+                args = list(args)
+                progress = args[how] = _Progress(args[how])
+            else:
+                progress = kwds['callback'] = _Progress(kwds.get('callback'))
+            start = clock()
+            try:
+                return func(*args, **kwds)
+            finally:
+                _record(name, clock() - start, progress.bytes)
+    else:
+        def wrapper(*args, **kwds):
+            start = clock()
+            try:
+                return func(*args, **kwds)
+            finally:
+                _record(name, clock() - start)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def isEnabled():
+    """True while recording."""
+    return bool(_originals)
+
+
+def enable():
+    """Starts recording, wrapping the Path methods."""
+    with _lock:
+        if _originals:
+            return
+        cls = _Path.Path
+        for name, attr, how in _TARGETS:
+            func = _originals[attr] = vars(cls)[attr]
+            setattr(cls, attr, _wrap(name, func, how))
+        # size is a property of the unwrapped getsize, so replace it too
+        _originals['size'] = vars(cls)['size']
+        cls.size = property(cls.getsize, doc=_originals['size'].__doc__)
+    reset()
+
+
+def disable():
+    """Stops recording, restoring the Path methods.  The statistics so far
+       are kept."""
+    with _lock:
+        cls = _Path.Path
+        for attr, value in _originals.items():
+            setattr(cls, attr, value)
+        _originals.clear()
+
+
+def reset():
+    """Clears all statistics recorded so far."""
+    with _lock:
+        _stats.clear()
+        _started[0] = time.time()
+        gpath = _Path.GPathStats()
+        _gpathBase[:] = gpath['hits'], gpath['misses']
+
+
+def getStats():
+    """Returns a dictionary of everything recorded: per operation, the number
+       of calls, total/mean/percentile/max times in seconds, and bytes
+       processed; and GPath intern table hits and misses."""
+    with _lock:
+        ops = {name: stats.toDict() for name, stats in _stats.items()}
+        started = _started[0]
+        hitsBase, missesBase = _gpathBase
+    gpath = _Path.GPathStats()
+    hits = gpath['hits'] - hitsBase
+    misses = gpath['misses'] - missesBase
+    calls = hits + misses
+    return {'started': started,
+            'elapsed': time.time() - started if started else 0.0,
+            'pid': os.getpid(),
+            'python': sys.version.split()[0],
+            'operations': ops,
+            'gpath': {'hits': hits,
+                      'misses': misses,
+                      'hitRate': hits / calls if calls else 0.0,
+                      'size': gpath['size'],
+                      },
+            }
+
+
+def report(format='text'):
+    """Returns the statistics as a string, either 'json' or 'text' (a table
+       for reading)."""
+    stats = getStats()
+    if format == 'json':
+        return json.dumps(stats, indent=2, sort_keys=True)
+    lines = ['Path statistics, %.1f seconds recorded' % stats['elapsed'],
+             '',
+             '%-8s %8s %10s %9s %9s %9s %9s %9s %10s' % (
+                 'Op', 'Calls', 'Total(s)', 'Mean(ms)', 'p50(ms)', 'p90(ms)',
+                 'p99(ms)', 'Max(ms)', 'MB'),
+             ]
+    for name, op in sorted(stats['operations'].items()):
+        lines.append('%-8s %8d %10.3f %9.3f %9.3f %9.3f %9.3f %9.3f %10.1f'
+                     % (name, op['calls'], op['total'], op['mean'] * 1000,
+                        op['p50'] * 1000, op['p90'] * 1000,
+                        op['p99'] * 1000, op['max'] * 1000,
+                        op['bytes'] / 1048576))
+    gpath = stats['gpath']
+    lines.append('')
+    lines.append('GPath: %d hits, %d misses (%.1f%% hits), %d interned' % (
+        gpath['hits'], gpath['misses'], gpath['hitRate'] * 100,
+        gpath['size']))
+    return '\n'.join(lines) + '\n'
+
+
+def dump(fileName, format=None):
+    """Writes the statistics to fileName.  Unless format is given, it's JSON
+       if the file name ends in '.json', otherwise text."""
+    if format is None:
+        format = 'json' if fileName.lower().endswith('.json') else 'text'
+    with open(fileName, 'w') as out:
+        out.write(report(format))
@@ -25,21 +25,212 @@
 # =============================================================================
 
 
-from opcode import opmap, HAVE_ARGUMENT, EXTENDED_ARG
-globals().update(opmap)
+# Modified from the original recipe to work on any CPython bytecode format:
+# the 3 byte instructions before 3.6, the wordcode of 3.6+, and the inline
+# caches and NULL pushing LOAD_GLOBALs of 3.11+.  Instructions are rewritten in
+# place (padded with NOPs), so jumps, line numbers and exception tables stay
+# valid.  Folding of tuples of constants is left out, the compiler does that
+# itself now.  Attribute lookups are only folded on modules, since attributes
+# of other objects might change later.
+
+import os
+import sys
+from types import CodeType, FunctionType, ModuleType
+from opcode import opmap
+
+
+_VERSION = sys.version_info[:2]
+
+# Set to False (or set the BOLT_NOOPTIMIZE environment variable) to turn
+# off all optimizations.  This has to happen before the modules using them are
+# imported.  Off by default on 3.11+: the interpreter specializes global
+# lookups itself, and the NOPs needed to fill the inline caches of the
+# replaced instructions make the optimized code slower there.
+enabled = not os.environ.get('BOLT_NOOPTIMIZE') and _VERSION < (3, 11)
+
+# Newer versions change the bytecode in ways not handled here
+_SUPPORTED = _VERSION <= (3, 13)
+# Whether _self_test has run yet, it's put off until something is optimized
+_checked = False
+_WORDCODE = _VERSION >= (3, 6)
+# 3.11+: the low bit of LOAD_GLOBAL's argument means push a NULL for CALL
+_GLOBAL_NULL = _VERSION >= (3, 11)
+# 3.12+: LOAD_ATTR's low bit means method call form, replacing LOAD_METHOD
+_ATTR_METHOD = _VERSION >= (3, 12)
+# 3.13+: that NULL goes after the object instead of before
+_NULL_AFTER = _VERSION >= (3, 13)
+
+_EXTENDED_ARG = opmap['EXTENDED_ARG']
+_LOAD_CONST = opmap['LOAD_CONST']
+_NOP = opmap['NOP']
+_PUSH_NULL = opmap.get('PUSH_NULL')
+_STORES = {'STORE_GLOBAL', 'DELETE_GLOBAL'}
+
+
+def _encode(opcode, arg=None):
+    """Encodes one instruction, with any EXTENDED_ARGs it needs."""
+    if _WORDCODE:
+        arg = arg or 0
+        code = [opcode, arg & 0xFF]
+        arg >>= 8
+        while arg:
+            code[:0] = [_EXTENDED_ARG, arg & 0xFF]
+            arg >>= 8
+        return code
+    if arg is None:
+        return [opcode]
+    code = [opcode, arg & 0xFF, (arg >> 8) & 0xFF]
+    if arg > 0xFFFF:
+        code[:0] = [_EXTENDED_ARG, (arg >> 16) & 0xFF, arg >> 24]
+    return code
+
+
+_NOP_SIZE = len(_encode(_NOP))
+_PREFIX_SIZE = len(_encode(_EXTENDED_ARG, 0))
+
+
+def _spans(co):
+    """Yields (instruction, start, end) for each instruction of co, where
+       start includes any EXTENDED_ARGs before it, and end any inline caches
+       after it."""
+    import dis
+    code = co.co_code
+    insts = []
+    starts = []
+    prefix = None
+    for inst in dis.get_instructions(co):
+        if inst.opcode == _EXTENDED_ARG:
+            if prefix is None:
+                prefix = inst.offset
+            continue
+        start = inst.offset if prefix is None else prefix
+        prefix = None
+        # Some versions of dis don't show the EXTENDED_ARGs, with wordcode
+        # they're easy to find
+        while (_WORDCODE and start >= _PREFIX_SIZE and
+               code[start - _PREFIX_SIZE] == _EXTENDED_ARG):
+            start -= _PREFIX_SIZE
+        insts.append(inst)
+        starts.append(start)
+    starts.append(len(code))
+    for i, inst in enumerate(insts):
+        yield inst, starts[i], starts[i+1]
+
+
+def _stored(co):
+    """Returns the names of globals assigned to in co, or any code inside
+       it."""
+    import dis
+    stored = {inst.argval for inst in dis.get_instructions(co)
+              if inst.opname in _STORES}
+    for value in co.co_consts:
+        if isinstance(value, CodeType):
+            stored |= _stored(value)
+    return stored
+
+
+def _optimize_code(co, env, stoplist, verbose):
+    """Returns co with global lookups converted to constants, or co itself
+       if nothing changed."""
+    newcode = bytearray(co.co_code)
+    newconsts = list(co.co_consts)
+    names = co.co_names
+    changed = False
+
+    def const(value):
+        for pos, v in enumerate(newconsts):
+            if v is value:
+                return pos
+        newconsts.append(value)
+        return len(newconsts) - 1
+
+    def emit(start, end, value, null):
+        code = _encode(_LOAD_CONST, const(value))
+        if null:
+            if _NULL_AFTER:
+                code += _encode(_PUSH_NULL)
+            else:
+                code = _encode(_PUSH_NULL) + code
+        pad = end - start - len(code)
+        if pad < 0:
+            return False
+        newcode[start:end] = bytes(code + _encode(_NOP) * (pad // _NOP_SIZE))
+        return True
+
+    import dis
+    insts = list(_spans(co))
+    targets = {inst.offset for inst in dis.get_instructions(co)
+               if inst.is_jump_target}
+    # Start and value of a module constant just loaded, for folding
+    # attribute lookups on it
+    pending = None
+    for inst, start, end in insts:
+        opname = inst.opname
+        if opname == 'LOAD_GLOBAL':
+            name = inst.argval
+            if name in env and name not in stoplist:
+                value = env[name]
+                null = _GLOBAL_NULL and inst.arg & 1
+                if emit(start, end, value, null):
+                    changed = True
+                    if verbose:
+                        print(name, '-->', value)
+                    if not null and isinstance(value, ModuleType):
+                        pending = (start, value)
+                        continue
+        elif (opname in ('LOAD_ATTR', 'LOAD_METHOD') and pending
+              and start not in targets):
+            method = opname == 'LOAD_METHOD'
+            index = inst.arg
+            if _ATTR_METHOD:
+                method = index & 1
+                index >>= 1
+            if not method or _PUSH_NULL is not None:
+                obj = pending[1]
+                try:
+                    value = getattr(obj, names[index])
+                except AttributeError:
+                    pass
+                else:
+                    if emit(pending[0], end, value, method):
+                        changed = True
+                        if verbose:
+                            print('new folded constant:', value)
+                        if not method and isinstance(value, ModuleType):
+                            pending = (pending[0], value)
+                            continue
+        pending = None
+    # Functions, lambdas and comprehensions defined inside
+    for pos, value in enumerate(newconsts):
+        if isinstance(value, CodeType):
+            newvalue = _optimize_code(value, env, stoplist, verbose)
+            if newvalue is not value:
+                newconsts[pos] = newvalue
+                changed = True
+    if not changed:
+        return co
+    if hasattr(co, 'replace'):
+        return co.replace(co_code=bytes(newcode), co_consts=tuple(newconsts))
+    return CodeType(co.co_argcount, co.co_kwonlyargcount, co.co_nlocals,
+                    co.co_stacksize, co.co_flags, bytes(newcode),
+                    tuple(newconsts), co.co_names, co.co_varnames,
+                    co.co_filename, co.co_name, co.co_firstlineno,
+                    co.co_lnotab, co.co_freevars, co.co_cellvars)
 
 
 def _make_constants(f, builtin_only=False, stoplist=[], verbose=False):
+    if not enabled or not _SUPPORTED:
+        return f
+    if not _checked:
+        _check()
+        if not _SUPPORTED:
+            return f
     if verbose:
         print('optimizing', f.__name__)
     try:
         co = f.__code__
     except AttributeError:
         return f        # Jython doesn't have a func_code attribute.
-    newcode = list(co.co_code)
-    newconsts = list(co.co_consts)
-    names = co.co_names
-    codelen = len(newcode)
 
     import builtins
     env = vars(builtins).copy()
@@ -49,100 +240,50 @@ def _make_constants(f, builtin_only=False, stoplist=[], verbose=False):
     else:
         env.update(f.__globals__)
 
-    # First pass converts global lookups into constants
-    changed = False
-    i = 0
-    while i < codelen:
-        opcode = newcode[i]
-        if opcode in (EXTENDED_ARG, STORE_GLOBAL):
-            return f    # for simplicity, only optimize common cases
-        if opcode == LOAD_GLOBAL:
-            oparg = newcode[i+1] + (newcode[i+2] << 8)
-            name = co.co_names[oparg]
-            if name in env and name not in stoplist:
-                value = env[name]
-                for pos, v in enumerate(newconsts):
-                    if v is value:
-                        break
-                else:
-                    pos = len(newconsts)
-                    newconsts.append(value)
-                newcode[i] = LOAD_CONST
-                newcode[i+1] = pos & 0xFF
-                newcode[i+2] = pos >> 8
-                changed = True
-                if verbose:
-                    print(name, '-->', value)
-        i += 1
-        if opcode >= HAVE_ARGUMENT:
-            i += 2
-
-    # Second pass folds tuples of constants and constant attribute lookups
-    i = 0
-    while i < codelen:
-
-        newtuple = []
-        while newcode[i] == LOAD_CONST:
-            oparg = newcode[i+1] + (newcode[i+2] << 8)
-            newtuple.append(newconsts[oparg])
-            i += 3
-
-        opcode = newcode[i]
-        if not newtuple:
-            i += 1
-            if opcode >= HAVE_ARGUMENT:
-                i += 2
-            continue
-
-        if opcode == LOAD_ATTR:
-            obj = newtuple[-1]
-            oparg = newcode[i+1] + (newcode[i+2] << 8)
-            name = names[oparg]
-            try:
-                value = getattr(obj, name)
-            except AttributeError:
-                continue
-            deletions = 1
-
-        elif opcode == BUILD_TUPLE:
-            oparg = newcode[i+1] + (newcode[i+2] << 8)
-            if oparg != len(newtuple):
-                continue
-            deletions = len(newtuple)
-            value = tuple(newtuple)
-
-        else:
-            continue
+    try:
+        # Globals that get assigned to can't be treated as constants
+        stoplist = set(stoplist) | _stored(co)
+        newco = _optimize_code(co, env, stoplist, verbose)
+    except Exception:
+        # Unexpected bytecode, leave it as is
+        return f
+    if newco is co:
+        return f
+    newf = FunctionType(newco, f.__globals__, f.__name__, f.__defaults__,
+                        f.__closure__)
+    newf.__kwdefaults__ = f.__kwdefaults__
+    newf.__dict__.update(f.__dict__)
+    for attr in ('__doc__', '__module__', '__qualname__', '__annotations__'):
+        setattr(newf, attr, getattr(f, attr))
+    return newf
 
-        reljump = deletions * 3
-        newcode[i-reljump] = JUMP_FORWARD
-        newcode[i-reljump+1] = (reljump-3) & 0xFF
-        newcode[i-reljump+2] = (reljump-3) >> 8
 
-        n = len(newconsts)
-        newconsts.append(value)
-        newcode[i] = LOAD_CONST
-        newcode[i+1] = n & 0xFF
-        newcode[i+2] = n >> 8
-        i += 3
-        changed = True
-        if verbose:
-            print("new folded constant:", value)
+def _self_test():
+    """Checks optimized code actually works on this interpreter."""
+    global enabled
+    def probe(x):
+        return os.path.join(str(x), os.sep.join([repr(x)])), len(range(x))
+    was, enabled = enabled, True
+    try:
+        optimized = _make_constants(probe)
+        return optimized is not probe and optimized(3) == probe(3)
+    except Exception:
+        return False
+    finally:
+        enabled = was
 
-    if not changed:
-        return f
 
-    codestr = bytes(newcode)
-    codeobj = type(co)(co.co_argcount, co.co_kwonlyargcount, co.co_nlocals, co.co_stacksize,
-                    co.co_flags, codestr, tuple(newconsts), co.co_names,
-                    co.co_varnames, co.co_filename, co.co_name,
-                    co.co_firstlineno, co.co_lnotab, co.co_freevars,
-                    co.co_cellvars)
-    return type(f)(codeobj, f.__globals__, f.__name__, f.__defaults__,
-                    f.__closure__)
+def _check():
+    """Runs _self_test, the first time something is optimized."""
+    global _SUPPORTED, _checked
+    _checked = True
+    if not _self_test():
+        _SUPPORTED = False
 
 
-_make_constants = _make_constants(_make_constants) # optimize thyself!
+_make_constants = _make_constants(_make_constants, # optimize thyself!
+                                  stoplist=['enabled', '_SUPPORTED',
+                                            '_checked'])
 
 
 def bind_all(mc, builtin_only=False, stoplist=[],  verbose=False):
@@ -153,7 +294,8 @@ def bind_all(mc, builtin_only=False, stoplist=[],  verbose=False):
     builtin_only to True.
 
     """
-    from types import FunctionType, ModuleType
+    if not enabled or not _SUPPORTED:
+        return
 
     def _bind_all(mc, builtin_only=False, stoplist=[],  verbose=False):
 
@@ -173,7 +315,7 @@ def bind_all(mc, builtin_only=False, stoplist=[],  verbose=False):
         elif isinstance(v, type):
             _bind_all(v, builtin_only, stoplist, verbose)
     else:
-        _bind_all(v, builtin_only, stoplist, verbose)
+        _bind_all(mc, builtin_only, stoplist, verbose)
 
 
 @_make_constants
@@ -184,7 +326,7 @@ def make_constants(builtin_only=False, stoplist=[], verbose=False):
     If not defined, the dynamic (runtime) global lookup is left undisturbed.
     If builtin_only is True, then only builtins are optimized.
     Variable names in the stoplist are also left undisturbed.
-    Also, folds constant attr lookups and tuples of constants.
+    Also, folds constant attr lookups on modules.
     If verbose is True, prints each substitution as is occurs
 
     """
@@ -226,5 +368,4 @@ def make_constants(builtin_only=False, stoplist=[], verbose=False):
 # list --> <class 'list'>
 # range --> <class 'range'>
 # int --> <class 'int'>
-# new folded constant: (<class 'list'>, <class 'tuple'>, <class 'str'>)
 # """
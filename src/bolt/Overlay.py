@@ -0,0 +1,461 @@
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software; you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 2 of the License, or (at your option)
+#  any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful, but WITHOUT ANY
+#  WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#  details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  Wrye Bash; if not, write to the Free Software Foundation, Inc.,
+#  59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye
+#
+# =============================================================================
+
+
+"""This module contains Overlay, a PathUnion of many directories ("layers")
+   that indexes every file in them, to act as a virtual directory tree.  This
+   is how the game sees its Data folder when mods are installed on top of each
+   other."""
+
+
+# Imports ---------------------------------------------------------------------
+#--Standard
+import os
+import array
+import bisect
+
+#--Local
+from .Path import GPath, GPathMany, getNorm, PathUnion, _scandir
+
+
+class _Layer(object):
+    """One directory of an Overlay.  The files in it are stored as a sorted
+       array of file ids (see Overlay), with a parallel array of their
+       mtimes for MODE_TIMESTAMP overlays.  slot is the layer's permanent
+       number in the overlay, rank its current position in the priority
+       order."""
+
+    __slots__ = ('path', 'ids', 'mtimes', 'slot', 'rank')
+
+    def __init__(self, path, slot):
+        self.path = path
+        self.ids = array.array('I')
+        self.mtimes = None
+        self.slot = slot
+        self.rank = slot
+
+    def find(self, fid):
+        """Returns the position of file fid in this layer, or -1 if the layer
+           doesn't have it."""
+        ids = self.ids
+        pos = bisect.bisect_left(ids, fid)
+        if pos < len(ids) and ids[pos] == fid:
+            return pos
+        return -1
+
+    def mtime(self, fid):
+        """Returns the mtime of file fid, which must be in this layer."""
+        return self.mtimes[self.find(fid)]
+
+
+class Overlay(PathUnion):
+    """A PathUnion that indexes every file in all of its directories (layers)
+       when created, so it can be used as one virtual directory tree: walked,
+       listed, and checked for which layer wins each file, without touching
+       the disk again.  The winner is decided by the mode, like for
+       PathUnion.  When the files in a layer change, refreshLayer updates
+       only what that layer affects.
+
+       To keep memory use low for many layers and files, each relative file
+       path is stored once and given a number (its file id).  Layers store
+       arrays of file ids, and the winning layer of every file is kept in one
+       array indexed by file id.  This also makes it a conflict index: which
+       files of a layer are overridden by others, or override others.
+       Layers can be added, removed and reordered, again only updating the
+       files of that layer.
+
+       Layers are specified either by their index in dirs (the priority
+       order) or by their directory.
+
+       Only files are indexed: join resolves files, for anything else (like
+       directories) it returns the path in the first layer, like PathUnion
+       does for names that don't exist."""
+
+    __slots__ = ('_names', '_ids', '_layers', '_slots', '_winners',
+                 '_counts')
+
+    def __init__(self, *names, mode=PathUnion.MODE_ORDER):
+        PathUnion.__init__(self, *names, mode=mode)
+        self._build()
+
+    def _build(self):
+        """Indexes all the layers from scratch."""
+        self._names = []        # file id -> relative path
+        self._ids = {}          # case normalized relative path -> file id
+        self._layers = [_Layer(dirname, slot)
+                        for slot, dirname in enumerate(self.dirs)]
+        self._slots = list(self._layers)  # slot -> layer, None once removed
+        self._winners = array.array('i')  # file id -> winning slot, or -1
+        self._counts = array.array('I')   # file id -> number of layers
+        for layer in self._layers:
+            self._scanLayer(layer)
+        self._resolveAll()
+
+    def __repr__(self):
+        """Representaion of an Overlay"""
+        return 'Overlay('+str(self.dirs)+')'
+
+    def __len__(self):
+        """Number of files in the overlay."""
+        return len(self._winners) - self._winners.count(-1)
+
+    #--Building the index -----------------------------------------------------
+    def _scanLayer(self, layer):
+        """Reads the files in layer's directory, and stores their file ids
+           (and mtimes if needed) in the layer.  Returns the ids and mtimes
+           the layer had before."""
+        ids = self._ids
+        names = self._names
+        normcase = os.path.normcase
+        join = os.path.join
+        timestamp = self._mode & PathUnion.MODE_TIMESTAMP
+        found = []
+        stack = [('', layer.path._s)]
+        while stack:
+            rel, full = stack.pop()
+            try:
+                entries = list(_scandir(full))
+            except OSError:
+                continue
+            for entry in entries:
+                name = join(rel, entry.name) if rel else entry.name
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            stack.append((name, entry.path))
+                        continue
+                    mtime = entry.stat().st_mtime if timestamp else 0.0
+                except OSError:
+                    # Removed while scanning
+                    continue
+                cs = normcase(name)
+                fid = ids.get(cs)
+                if fid is None:
+                    fid = ids[cs] = len(names)
+                    names.append(name)
+                    self._winners.append(-1)
+                    self._counts.append(0)
+                found.append((fid, mtime))
+        found.sort()
+        old = (layer.ids, layer.mtimes)
+        layer.ids = array.array('I', [x[0] for x in found])
+        if timestamp:
+            layer.mtimes = array.array('d', [x[1] for x in found])
+        return old
+
+    def _resolveAll(self):
+        """Decides the winner of every file, from scratch."""
+        count = len(self._names)
+        winners = self._winners = array.array('i', [-1]) * count
+        counts = self._counts = array.array('I', [0]) * count
+        timestamp = self._mode & PathUnion.MODE_TIMESTAMP
+        reverse = self._mode & PathUnion.MODE_REVERSE
+        if timestamp:
+            best = array.array('d', [0.0]) * count
+        for layer in self._layers:
+            slot = layer.slot
+            if not timestamp:
+                for fid in layer.ids:
+                    counts[fid] += 1
+                    if winners[fid] < 0:
+                        # First one found wins
+                        winners[fid] = slot
+                continue
+            for fid, mtime in zip(layer.ids, layer.mtimes):
+                counts[fid] += 1
+                # Same tie breaking as PathUnion.join
+                if (winners[fid] < 0 or (reverse and not best[fid] < mtime)
+                        or (not reverse and best[fid] < mtime)):
+                    winners[fid] = slot
+                    best[fid] = mtime
+
+    def _resolve(self, fids):
+        """Decides the winner of the specified files, by checking every
+           layer for them."""
+        winners = self._winners
+        timestamp = self._mode & PathUnion.MODE_TIMESTAMP
+        reverse = self._mode & PathUnion.MODE_REVERSE
+        for fid in fids:
+            winner = -1
+            for layer in self._layers:
+                pos = layer.find(fid)
+                if pos < 0:
+                    continue
+                if not timestamp:
+                    winner = layer.slot
+                    break
+                mtime = layer.mtimes[pos]
+                if (winner < 0 or (reverse and not best < mtime)
+                        or (not reverse and best < mtime)):
+                    winner = layer.slot
+                    best = mtime
+            winners[fid] = winner
+
+    def _beats(self, fid, layer):
+        """True if layer would win file fid over its current winner."""
+        winner = self._winners[fid]
+        if winner < 0:
+            return True
+        winner = self._slots[winner]
+        if not self._mode & PathUnion.MODE_TIMESTAMP:
+            return layer.rank < winner.rank
+        mtime = layer.mtime(fid)
+        best = winner.mtime(fid)
+        if self._mode & PathUnion.MODE_REVERSE:
+            # Oldest wins, on a tie the later layer
+            return mtime < best or (mtime == best and layer.rank > winner.rank)
+        # Newest wins, on a tie the earlier layer
+        return best < mtime or (mtime == best and layer.rank < winner.rank)
+
+    def _layer(self, layer):
+        """Returns the _Layer for a layer specified either by its index or its
+           directory."""
+        if isinstance(layer, int):
+            return self._layers[layer]
+        layer = GPath(layer)
+        for item in self._layers:
+            if item.path == layer:
+                return item
+        raise ValueError('%s is not a layer of this Overlay' % layer)
+
+    def _reorder(self):
+        """Updates the ranks of the layers and dirs after the priority order
+           of the layers changed."""
+        for rank, layer in enumerate(self._layers):
+            layer.rank = rank
+        self.dirs[:] = [layer.path for layer in self._layers]
+
+    def refresh(self):
+        """Re-reads every layer from scratch."""
+        PathUnion.refresh(self)
+        self._build()
+
+    def refreshLayer(self, layer):
+        """Re-reads the files in one layer after they've changed, and updates
+           the winners of only the files affected."""
+        layer = self._layer(layer)
+        slot = layer.slot
+        oldIds, oldMtimes = self._scanLayer(layer)
+        old = set(oldIds)
+        new = set(layer.ids)
+        winners = self._winners
+        counts = self._counts
+        recheck = []
+        for fid in old - new:
+            counts[fid] -= 1
+            if winners[fid] == slot:
+                recheck.append(fid)
+        for fid in new - old:
+            counts[fid] += 1
+            if self._beats(fid, layer):
+                winners[fid] = slot
+        if layer.mtimes is not None:
+            # Files whose mtime changed might win or lose now
+            oldMtimes = dict(zip(oldIds, oldMtimes))
+            for fid, mtime in zip(layer.ids, layer.mtimes):
+                if fid in old and oldMtimes[fid] != mtime:
+                    if winners[fid] == slot:
+                        recheck.append(fid)
+                    elif self._beats(fid, layer):
+                        winners[fid] = slot
+        self._resolve(recheck)
+
+    def addLayer(self, dirname, index=None):
+        """Adds a new layer for directory dirname, at position index in the
+           priority order (by default, last)."""
+        layer = _Layer(GPath(dirname), len(self._slots))
+        self._slots.append(layer)
+        if index is None:
+            index = len(self._layers)
+        self._layers.insert(index, layer)
+        self._reorder()
+        self._scanLayer(layer)
+        winners = self._winners
+        counts = self._counts
+        slot = layer.slot
+        for fid in layer.ids:
+            counts[fid] += 1
+            if self._beats(fid, layer):
+                winners[fid] = slot
+
+    def removeLayer(self, layer):
+        """Removes a layer, files it won go to the next best layer."""
+        layer = self._layer(layer)
+        self._layers.remove(layer)
+        self._slots[layer.slot] = None
+        self._reorder()
+        winners = self._winners
+        counts = self._counts
+        slot = layer.slot
+        recheck = []
+        for fid in layer.ids:
+            counts[fid] -= 1
+            if winners[fid] == slot:
+                recheck.append(fid)
+        self._resolve(recheck)
+
+    def moveLayer(self, layer, index):
+        """Moves a layer to position index in the priority order.  Only the
+           files in that layer can change winners."""
+        layer = self._layer(layer)
+        self._layers.remove(layer)
+        self._layers.insert(index, layer)
+        self._reorder()
+        winners = self._winners
+        counts = self._counts
+        slot = layer.slot
+        recheck = []
+        for fid in layer.ids:
+            if counts[fid] > 1:
+                if winners[fid] == slot:
+                    recheck.append(fid)
+                elif self._beats(fid, layer):
+                    winners[fid] = slot
+        self._resolve(recheck)
+
+    #--Queries ----------------------------------------------------------------
+    def _fid(self, args):
+        """Returns the file id for the relative path made by joining args, or
+           None if it's not in the overlay."""
+        if not args:
+            return None
+        rel = os.path.normpath(os.path.join(*[getNorm(x) for x in args]))
+        return self._ids.get(os.path.normcase(rel))
+
+    def join(self, *args):
+        """Return Path object from joining directory with names.  If that's a
+           file in the overlay, the path is in the layer that wins it."""
+        fid = self._fid(args)
+        if fid is not None:
+            winner = self._winners[fid]
+            if winner >= 0:
+                return self._slots[winner].path.join(*args)
+        return self.dirs[0].join(*args)
+
+    def winner(self, *args):
+        """Returns the directory of the layer that wins the file made by
+           joining args, or None if no layer has it."""
+        fid = self._fid(args)
+        if fid is None or self._winners[fid] < 0:
+            return None
+        return self._slots[self._winners[fid]].path
+
+    def layersOf(self, *args):
+        """Returns a list of the directories of all layers that have the file
+           made by joining args, the winner first, then the rest in priority
+           order."""
+        fid = self._fid(args)
+        if fid is None or self._winners[fid] < 0:
+            return []
+        winner = self._slots[self._winners[fid]]
+        return [winner.path] + [layer.path for layer in self._layers
+                                if layer is not winner
+                                and layer.find(fid) >= 0]
+
+    def overridden(self, layer):
+        """Returns a dictionary of the files in layer that are won by other
+           layers, to the directory of the layer winning each."""
+        layer = self._layer(layer)
+        slot = layer.slot
+        slots = self._slots
+        winners = self._winners
+        names = self._names
+        return {GPath(names[fid]): slots[winners[fid]].path
+                for fid in layer.ids if winners[fid] != slot}
+
+    def overriding(self, layer):
+        """Returns a list of the files layer wins that other layers also
+           have."""
+        layer = self._layer(layer)
+        slot = layer.slot
+        winners = self._winners
+        counts = self._counts
+        return GPathMany(self._names[fid] for fid in layer.ids
+                         if winners[fid] == slot and counts[fid] > 1)
+
+    def files(self):
+        """Returns a dictionary of the relative path of every file in the
+           overlay, to its real path in the winning layer."""
+        slots = self._slots
+        names = self._names
+        return {GPath(names[fid]): slots[winner].path.join(names[fid])
+                for fid, winner in enumerate(self._winners) if winner >= 0}
+
+    def list(self):
+        """Returns a set of the files/directories in the top directory of the
+           overlay."""
+        sep = os.sep
+        names = self._names
+        return set(GPathMany(names[fid].split(sep, 1)[0]
+                             for fid, winner in enumerate(self._winners)
+                             if winner >= 0))
+
+    def walk(self):
+        """Like os.walk (top down) on the virtual tree, yielding a tuple of
+           the relative path of each directory, and lists of the
+           subdirectories and files in it, as Path objects."""
+        tree = {'': (set(), [])}
+        split = os.path.split
+        names = self._names
+        for fid, winner in enumerate(self._winners):
+            if winner < 0:
+                continue
+            head, tail = split(names[fid])
+            node = tree.get(head)
+            if node is None:
+                # New directory, add it and any parents to the tree
+                node = tree[head] = (set(), [])
+                child = head
+                while True:
+                    parent, name = split(child)
+                    parentNode = tree.get(parent)
+                    if parentNode is None:
+                        parentNode = tree[parent] = (set(), [])
+                        parentNode[0].add(name)
+                        child = parent
+                    else:
+                        parentNode[0].add(name)
+                        break
+            node[1].append(tail)
+        stack = ['']
+        while stack:
+            dirname = stack.pop()
+            subdirs, files = tree[dirname]
+            subdirs = sorted(subdirs)
+            yield (GPath(dirname), GPathMany(subdirs), GPathMany(sorted(files)))
+            stack.extend(os.path.join(dirname, x) if dirname else x
+                         for x in reversed(subdirs))
+
+    def conflicts(self):
+        """Returns a dictionary of every file found in more than one layer,
+           to a list of the directories of those layers, the winner first."""
+        counts = self._counts
+        winners = self._winners
+        layers = {}
+        for layer in self._layers:
+            slot = layer.slot
+            for fid in layer.ids:
+                if counts[fid] > 1 and winners[fid] != slot:
+                    layers.setdefault(fid, []).append(layer.path)
+        names = self._names
+        slots = self._slots
+        return {GPath(names[fid]): [slots[winners[fid]].path] + others
+                for fid, others in layers.items()}
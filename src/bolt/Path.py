@@ -26,39 +26,54 @@
 
 # Imports ---------------------------------------------------------------------
 #--Standard
+#  Modules only some operations need (shutil, subprocess, tempfile, json,
+#  concurrent.futures, ...) are imported by the functions using them, so
+#  importing this module stays fast.
 import os
 import stat
-import shutil
 import time
-import random
 import sys
-import subprocess
-import codecs
-import tempfile
-import binascii
-import ctypes
-import ctypes.wintypes
+import mmap
+import collections
+import itertools
+import weakref
+import threading
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+try:
+    from os import scandir as _scandir
+except ImportError:
+    # Python < 3.5, use the backport if available, otherwise a slower
+    # emulation (see the end of this file)
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
 
 #--Local
 from src.bolt.Optimize import make_constants, bind_all
 
 
-# Startupinfo - so subprocess.Popen can launch things with no cmd.exe window
-startupinfo = None
-if os.name == 'nt':
-    startupinfo = subprocess.STARTUPINFO()
-    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-
 #--Paths ----------------------------------------------------------------------
 Path = None  # Place holder, so GPath doesn't have undefined 'Path'
 
 
 #--GPaths: global dictionary of saved Path class objects, to avoid duplication
-#  when dealing with lots of path items.
-_gpaths = {}
+#  when dealing with lots of path items.  Only weak references are held, so
+#  Path objects no longer used anywhere else are freed automatically.
+#  To allow many threads to create GPaths at once, the dictionary is split
+#  into shards, chosen by the hash of the path.  Lookups don't lock, creating
+#  a new Path locks only the shard it goes into.
+_GPATH_SHARDS = 16  # Must be a power of 2
+_gpaths = tuple(weakref.WeakValueDictionary() for x in range(_GPATH_SHARDS))
+_gpathLocks = tuple(threading.Lock() for x in range(_GPATH_SHARDS))
+_gpathStats = [[0, 0] for x in range(_GPATH_SHARDS)]    # hits, misses
 def GPath(name):
-    """Returns common Path instance for specified name/path."""
+    """Returns common Path instance for specified name/path.  Safe to call
+       from multiple threads."""
     if name is None:
         return None
     elif not name:
@@ -70,20 +85,800 @@ def GPath(name):
     else:
         norm = os.path.normpath(str(name))
     # Lookup
-    path = _gpaths.get(norm)
+    shard = hash(norm) & (_GPATH_SHARDS - 1)
+    paths = _gpaths[shard]
+    path = paths.get(norm)
     if path is not None:
+        # Not locked, so this count may be off slightly with many threads
+        _gpathStats[shard][0] += 1
         return path
+    return _gpathInsert(shard, norm)
+
+
+def _gpathInsert(shard, norm):
+    """Creates and interns the Path for norm, when a lookup in the shard
+       found nothing."""
+    paths = _gpaths[shard]
+    with _gpathLocks[shard]:
+        # Another thread may have created it while waiting on the lock
+        path = paths.get(norm)
+        if path is None:
+            path = paths[norm] = Path(norm)
+            _gpathStats[shard][1] += 1
+        else:
+            _gpathStats[shard][0] += 1
+    return path
+
+
+def GPathMany(names, base=None):
+    """Returns a list of common Path instances for many names at once, for
+       example the results of os.listdir.  Faster than calling GPath for each
+       name, since the names are assumed to be plain file or directory names
+       (no path separators, '.' or '..'), so aren't normalized.
+       base - If specified, the Paths are for the names joined to base."""
+    if base is None:
+        prefix = ''
     else:
-        return _gpaths.setdefault(norm,Path(norm))
+        prefix = getNorm(base)
+        if prefix and prefix != os.curdir:
+            prefix = os.path.join(prefix, '')
+        else:
+            prefix = ''
+    mask = _GPATH_SHARDS - 1
+    gpaths = _gpaths
+    stats = _gpathStats
+    insert = _gpathInsert
+    result = []
+    append = result.append
+    for name in names:
+        norm = prefix + name
+        shard = hash(norm) & mask
+        path = gpaths[shard].get(norm)
+        if path is None:
+            path = insert(shard, norm)
+        else:
+            stats[shard][0] += 1
+        append(path)
+    return result
 
 
 def GPathPurge():
-    """Cleans out the _gpaths dictionary of unused Path object."""
-    for key in _gpaths.keys():
-        if sys.getrefcount(_gpaths[key]) == 2:
-            # 1 reference held by _gpaths
-            # 1 reference held by this for loop
-            del _gpaths[key]
+    """Cleans out the _gpaths dictionary of unused Path object.  Unused Path
+       objects are now removed automatically, so this only resets the
+       statistics returned by GPathStats."""
+    for stats in _gpathStats:
+        stats[:] = [0, 0]
+
+
+def GPathStats():
+    """Returns a dictionary of statistics about the GPath intern table:
+         size - number of Path objects currently interned.
+         hits - number of GPath calls that returned an existing Path.
+         misses - number of GPath calls that had to create a new Path.
+         hitRate - hits / (hits + misses).
+         bytesSaved - estimate of the memory that would have been used by
+             the duplicate Path objects avoided by the hits."""
+    hits = sum(x[0] for x in _gpathStats)
+    misses = sum(x[1] for x in _gpathStats)
+    calls = hits + misses
+    paths = [path for shard in _gpaths for path in list(shard.values())]
+    if paths:
+        # Estimate the average size from a sample of the interned paths
+        sample = paths[::max(1, len(paths) // 1000)]
+        getsizeof = sys.getsizeof
+        average = sum(getsizeof(x) + getsizeof(x._s) + getsizeof(x._cs)
+                      for x in sample) / len(sample)
+    else:
+        average = 0
+    return {'size': len(paths),
+            'hits': hits,
+            'misses': misses,
+            'hitRate': hits / calls if calls else 0.0,
+            'bytesSaved': int(hits * average),
+            }
+
+
+#--CRC Cache: remembers the CRC of files, keyed on the case normalized path.
+#  An entry is only valid if the file's size and mtime are unchanged.
+class CRCCache(object):
+    """Least recently used cache of file CRCs, which can be persisted to disk
+       so unchanged files don't need to be re-read across runs.  Entries are
+       keyed on a case normalized path string, and store the size and mtime
+       (in nanoseconds) of the file at the time the CRC was calculated.
+       Safe to use from multiple threads."""
+
+    __slots__ = ('_entries', '_file', '_maxEntries', '_dirty', '_lock')
+
+    VERSION = 2     # 2: JSON instead of a pickle
+
+    def __init__(self, maxEntries=100000):
+        self._entries = collections.OrderedDict()
+        self._file = None
+        self._maxEntries = maxEntries
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, cs, size, mtime):
+        """Return the cached CRC for a file, or None if there is no valid
+           entry for it."""
+        with self._lock:
+            entry = self._entries.get(cs)
+            if entry is None:
+                return None
+            if entry[0] != size or entry[1] != mtime:
+                # File changed since it was cached
+                del self._entries[cs]
+                self._dirty = True
+                return None
+            self._entries.move_to_end(cs)
+            return entry[2]
+
+    def set(self, cs, size, mtime, crc):
+        """Store the CRC for a file, evicting the least recently used entries
+           if the cache is full."""
+        with self._lock:
+            entries = self._entries
+            entries[cs] = (size, mtime, crc)
+            entries.move_to_end(cs)
+            while len(entries) > self._maxEntries:
+                entries.popitem(last=False)
+            self._dirty = True
+
+    def invalidate(self, cs, tree=False):
+        """Remove the entry for a file.  If tree is True, also removes the
+           entries for all files under cs, for when a directory changes."""
+        with self._lock:
+            entries = self._entries
+            if entries.pop(cs, None) is not None:
+                self._dirty = True
+            if tree:
+                prefix = os.path.join(cs, '')
+                for key in [x for x in entries if x.startswith(prefix)]:
+                    del entries[key]
+                    self._dirty = True
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def load(self, fileName):
+        """Sets the file the cache is persisted to, and loads any entries
+           previously saved there.  A missing or corrupt file just results in
+           an empty cache.  The file is JSON rather than a pickle, so a
+           tampered with file can't run code."""
+        import json
+        self._file = getNorm(fileName)
+        try:
+            with open(self._file, 'r', encoding='utf-8') as ins:
+                data = json.load(ins)
+            if data['version'] != CRCCache.VERSION:
+                return
+            entries = collections.OrderedDict()
+            for cs, size, mtime, crc in data['entries']:
+                if not (isinstance(cs, str) and type(size) is int and
+                        type(mtime) is int and type(crc) is int):
+                    return
+                entries[cs] = (size, mtime, crc)
+        except (OSError, ValueError, TypeError, KeyError):
+            return
+        with self._lock:
+            # Entries already in memory are newer than the ones on disk
+            entries.update(self._entries)
+            while len(entries) > self._maxEntries:
+                entries.popitem(last=False)
+            self._entries = entries
+
+    def save(self):
+        """Write the cache to disk, if it has changed since loading."""
+        if not self._file or not self._dirty:
+            return
+        head = os.path.dirname(self._file)
+        if head and not os.path.exists(head):
+            os.makedirs(head)
+        # Write to a temp file, then replace, so an error while writing
+        # doesn't corrupt the existing cache.
+        import json
+        temp = self._file + '.tmp'
+        with self._lock:
+            entries = [[cs, size, mtime, crc] for cs, (size, mtime, crc)
+                       in self._entries.items()]
+            self._dirty = False
+        with open(temp, 'w', encoding='utf-8') as out:
+            json.dump({'version': CRCCache.VERSION, 'entries': entries}, out,
+                      separators=(',', ':'))
+        os.replace(temp, self._file)
+
+
+crcCache = CRCCache()
+
+
+def _progress_combiner(callback):
+    """For operations working on many files at once, each reporting its own
+       progress (bytes done so far for that file).  Returns a function to
+       call for each file, which returns the progress callback to use for
+       it.  These combine the progress of all files into a total, and call
+       callback with that.  If callback is None, the files get None too."""
+    if not callback:
+        return lambda: None
+    lock = threading.Lock()
+    total = [0]
+    def progress():
+        last = [0]
+        def update(pos):
+            with lock:
+                total[0] += pos - last[0]
+                last[0] = pos
+                callback(total[0])
+        return update
+    return progress
+
+
+#--CRC calculation settings
+_CRC_CHUNK = 2097152        # Read 2MB at a time
+_CRC_MMAP_SIZE = 67108864   # Memory map files 64MB and larger
+_CRC_MMAP_WINDOW = 67108864 # Mapping 64MB at a time, so 32 bit builds can too
+
+
+def _crc_mapped(ins, callback=None):
+    """CRC of the open file ins, memory mapping it one window at a time.
+       Returns the CRC and the number of bytes done.  If mapping fails (out
+       of address space, etc), that's less than the file's size, and the
+       rest should be read normally."""
+    from binascii import crc32
+    fileno = ins.fileno()
+    crc = 0
+    pos = 0
+    while True:
+        try:
+            # Size checked for each window, so as not to map past the end
+            # of a file truncated meanwhile
+            length = min(os.fstat(fileno).st_size - pos, _CRC_MMAP_WINDOW)
+            if length <= 0:
+                break
+            m = mmap.mmap(fileno, length, access=mmap.ACCESS_READ,
+                          offset=pos)
+        except (OSError, ValueError, OverflowError):
+            break
+        with m:
+            with memoryview(m) as view:
+                for start in range(0, length, _CRC_CHUNK):
+                    end = min(start + _CRC_CHUNK, length)
+                    crc = crc32(view[start:end], crc)
+                    if callback:
+                        callback(pos + end)
+        pos += length
+    return crc, pos
+
+
+def crc_many(paths, callback=None, threads=None):
+    """Calculates the CRC of many files at once, spread over a pool of
+       threads (binascii.crc32 releases the GIL while working).  Returns a
+       dictionary mapping each Path to its CRC.
+       threads - Number of worker threads, defaults to the number of CPUs.
+       paths - Path objects/strings, or PathEntry objects from Path.scan,
+           in which case the files don't need to be stat'd again.
+       callback - Like for Path.crc_callback, called with the total number
+           of bytes read so far for all files.  Note: it is called from the
+           worker threads, so UI code should marshal it to the main thread."""
+    jobs = {}
+    for path in paths:
+        if isinstance(path, PathEntry):
+            jobs[path.path] = path.stat
+        else:
+            jobs[GPath(path)] = None
+    if not jobs:
+        return {}
+    import concurrent.futures
+    progress = _progress_combiner(callback)
+    threads = threads if threads else (os.cpu_count() or 1)
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        futures = {executor.submit(path._crc, progress(), st): path
+                   for path, st in jobs.items()}
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+
+#--Directory scanning
+class PathEntry(object):
+    """A file or directory found by Path.scan.  Holds the Path object along
+       with the os.stat result obtained while scanning."""
+
+    __slots__ = ('path', 'isdir', 'stat')
+
+    def __init__(self, path, isdir, stat):
+        self.path = path
+        self.isdir = isdir
+        self.stat = stat
+
+    def __repr__(self):
+        return 'PathEntry(' + repr(self.path._s) + ')'
+
+    @property
+    def size(self):
+        """Size of the file, from the scanned stat."""
+        return self.stat.st_size
+
+    @property
+    def mtime(self):
+        """Time file was last modified, from the scanned stat."""
+        return self.stat.st_mtime
+
+    @property
+    def crc(self):
+        """CRC of the file, using the scanned stat for the cache lookup."""
+        return self.path._crc(None, self.stat)
+
+    @property
+    def readonly(self):
+        """Read-only status, from the scanned stat."""
+        return _is_readonly(self.stat)
+
+
+def _scan(top, recursive, topdown, onerror):
+    """Implementation of Path.scan."""
+    try:
+        entries = list(_scandir(top))
+    except OSError as e:
+        if onerror is not None:
+            onerror(e)
+        return
+    paths = GPathMany([entry.name for entry in entries], top)
+    for entry, path in zip(entries, paths):
+        try:
+            isdir = entry.is_dir()
+            item = PathEntry(path, isdir, entry.stat())
+        except OSError:
+            # Removed since it was listed
+            continue
+        if isdir and recursive and not entry.is_symlink():
+            if topdown:
+                yield item
+                yield from _scan(entry.path, recursive, topdown, onerror)
+            else:
+                yield from _scan(entry.path, recursive, topdown, onerror)
+                yield item
+        else:
+            yield item
+
+
+def _dir_size(top, progress=None):
+    """Total size of the files in top and its subdirectories.  progress is
+       called with the size of the files in each directory once scanned."""
+    total = 0
+    stack = [top]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        size = 0
+        try:
+            entries = list(_scandir(pop()))
+        except OSError:
+            # Directory removed while scanning, skip it like os.walk
+            entries = ()
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        push(entry.path)
+                else:
+                    size += entry.stat().st_size
+            except OSError:
+                # Broken symlink, or removed since being listed
+                pass
+        total += size
+        if progress is not None:
+            progress(size)
+    return total
+
+
+def _tree_size(top, callback=None, threads=None):
+    """Implementation of Path.getsize for directories."""
+    if callback:
+        lock = threading.Lock()
+        running = [0]
+        def progress(size):
+            with lock:
+                running[0] += size
+                callback(running[0])
+    else:
+        progress = None
+    if not threads or threads <= 1:
+        return _dir_size(top, progress)
+    # Total the files in top here, and the subdirectories in the pool
+    total = 0
+    subdirs = []
+    for entry in _scandir(top):
+        try:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+            else:
+                total += entry.stat().st_size
+        except OSError:
+            pass
+    if progress is not None:
+        progress(total)
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        total += sum(executor.map(_dir_size, subdirs,
+                                  [progress] * len(subdirs)))
+    return total
+
+
+def _walk_cached(top, st, cache):
+    """Yields (path, os.stat result, isdir) for every file and directory in
+       top and its subdirectories (symlinks to directories count as files).
+       The files and subdirectories of each directory are stored in cache (a
+       DirCache), so unchanged directories don't need to be listed again.
+       Everything is still stat'd every time, since changing a file doesn't
+       change its directory's mtime."""
+    stack = [(top, st)]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        dirname, dirStat = pop()
+        listing = cache.get(dirname, dirStat)
+        if listing is None:
+            try:
+                entries = list(_scandir(dirname))
+            except OSError:
+                # Removed while scanning, skip it like os.walk
+                continue
+            found = []
+            for entry in entries:
+                try:
+                    entryStat = entry.stat()
+                    isdir = entry.is_dir() and not entry.is_symlink()
+                except OSError:
+                    # Broken symlink, or removed since being listed
+                    continue
+                found.append((entry.path, entryStat, isdir))
+            cache.set(dirname, ([x[0] for x in found if not x[2]],
+                                [x[0] for x in found if x[2]]), dirStat)
+        else:
+            found = []
+            files, subdirs = listing
+            for isdir, paths in ((False, files), (True, subdirs)):
+                for path in paths:
+                    try:
+                        found.append((path, os.stat(path), isdir))
+                    except OSError:
+                        pass
+        for path, entryStat, isdir in found:
+            if isdir:
+                push((path, entryStat))
+            yield path, entryStat, isdir
+
+
+def _max_mtime(top, st, threshold=None):
+    """Implementation of Path.getmtime(maxMTime=True) and Path.hasNewer.
+       Returns the newest mtime of all files and directories in top, or None
+       if it's empty.  If threshold is given, returns as soon as something
+       newer than it is found.  Directory listings are cached in
+       _mtimeCache, see _walk_cached."""
+    newest = None
+    for path, entryStat, isdir in _walk_cached(top, st, _mtimeCache):
+        mtime = entryStat.st_mtime
+        if newest is None or mtime > newest:
+            newest = mtime
+            if threshold is not None and newest > threshold:
+                break
+    return newest
+
+
+class DirCache(object):
+    """Cache of the listings of directories (see _walk_cached).  An entry is
+       only used while the directory's mtime is the same as when it was
+       stored, which changes whenever entries directly in it are added,
+       removed or renamed.  Note it doesn't change when a file in it is
+       modified, so what's cached must not depend on the files' contents,
+       sizes or times.  Holds at most maxEntries directories, dropping the
+       least recently used ones."""
+
+    __slots__ = ('_entries', '_maxEntries', '_lock')
+
+    def __init__(self, maxEntries=10000):
+        self._entries = collections.OrderedDict()
+        self._maxEntries = maxEntries
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path, st=None):
+        """Return the value stored for directory path, or None if there isn't
+           one or the directory has changed.  st may be the already known
+           os.stat result for path."""
+        path = GPath(path)
+        entry = self._entries.get(path._cs)
+        if entry is None:
+            return None
+        if st is None:
+            try:
+                st = os.stat(path._s)
+            except OSError:
+                st = None
+        with self._lock:
+            if st is None or st.st_mtime_ns != entry[0]:
+                self._entries.pop(path._cs, None)
+                return None
+            if path._cs in self._entries:
+                self._entries.move_to_end(path._cs)
+        return entry[1]
+
+    def set(self, path, value, st=None):
+        """Store the value calculated for directory path."""
+        path = GPath(path)
+        if st is None:
+            st = os.stat(path._s)
+        with self._lock:
+            entries = self._entries
+            entries[path._cs] = (st.st_mtime_ns, value)
+            entries.move_to_end(path._cs)
+            while len(entries) > self._maxEntries:
+                entries.popitem(last=False)
+
+    def invalidate(self, path=None):
+        """Remove the entries affected by a change to path: the entry for
+           path itself and those for all directories containing it.  If path
+           is None, removes all entries."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                return
+            cs = getCase(path)
+            for key in list(self._entries):
+                if cs == key or cs.startswith(os.path.join(key, '')):
+                    del self._entries[key]
+
+
+# Files and subdirectories directly in each directory, for
+# Path.getmtime(maxMTime=True), for the most recently used 10000 directories
+_mtimeCache = DirCache()
+
+
+#--File copying
+_COPY_CHUNK = 8388608   # Copy 8MB at a time
+_FICLONE = 0x40049409   # Linux ioctl to reflink a file (btrfs, xfs, etc)
+# The ioctl number means something else (or nothing) on other systems
+_ioctl = fcntl.ioctl if fcntl is not None and sys.platform.startswith(
+    'linux') else None
+_copy_file_range = getattr(os, 'copy_file_range', None)
+# sendfile only supports copying to regular files on Linux
+_sendfile = getattr(os, 'sendfile', None) if sys.platform.startswith(
+    'linux') else None
+
+
+def _copy_data(ins, out, size, progress=None):
+    """Copies the data of file ins to file out (both unbuffered).  Uses the
+       fastest method available: reflinking (no data copied at all),
+       copying within the kernel, then reading/writing as a last resort."""
+    infd = ins.fileno()
+    outfd = out.fileno()
+    if _ioctl is not None and size:
+        try:
+            _ioctl(outfd, _FICLONE, infd)
+            if progress:
+                progress(size)
+            return
+        except OSError:
+            # Not supported by this file system
+            pass
+    copied = 0
+    if _copy_file_range is not None:
+        try:
+            while copied < size:
+                done = _copy_file_range(infd, outfd,
+                                        min(size - copied, _COPY_CHUNK))
+                if not done:
+                    break
+                copied += done
+                if progress:
+                    progress(copied)
+        except OSError:
+            # Not supported for these files, try the next method
+            pass
+    if _sendfile is not None and copied < size:
+        try:
+            while copied < size:
+                done = _sendfile(outfd, infd, copied,
+                                 min(size - copied, _COPY_CHUNK))
+                if not done:
+                    break
+                copied += done
+                if progress:
+                    progress(copied)
+        except OSError:
+            pass
+    # Copy whatever is left the normal way.  This also picks up anything
+    # appended since size was read.
+    ins.seek(copied)
+    out.seek(copied)
+    buffer = bytearray(min(size, _COPY_CHUNK) or 1)
+    with memoryview(buffer) as view:
+        insReadinto = ins.readinto
+        outWrite = out.write
+        while True:
+            read = insReadinto(buffer)
+            if not read:
+                break
+            outWrite(view[:read])
+            copied += read
+            if progress:
+                progress(copied)
+
+
+def _copy_file(src, dest, st, progress=None, mode=False):
+    """Copies file src to dest, along with its access/modified times.  st is
+       the os.stat result for src.  If mode is True, the permission bits are
+       copied too."""
+    try:
+        if os.stat(dest).st_nlink > 1:
+            # Hard linked (see hardlink and DedupeIndex), writing to it would
+            # change the other links too, maybe even src
+            os.remove(dest)
+    except FileNotFoundError:
+        pass
+    with open(src, 'rb', buffering=0) as ins:
+        with open(dest, 'wb', buffering=0) as out:
+            _copy_data(ins, out, st.st_size, progress)
+    _copy_stat(dest, st, mode)
+
+
+def _copy_stat(dest, st, mode=False):
+    """Sets the access/modified times of dest, and optionally its permission
+       bits, to those in the os.stat result st."""
+    os.utime(dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+    if mode:
+        os.chmod(dest, stat.S_IMODE(st.st_mode))
+
+
+def _link_file(src, dest):
+    """Hard links dest to src, replacing dest if it exists.  Returns False if
+       that isn't possible, for example when they're on different file
+       systems."""
+    try:
+        os.link(src, dest)
+    except FileExistsError:
+        try:
+            os.remove(dest)
+            os.link(src, dest)
+        except OSError:
+            return False
+    except OSError:
+        return False
+    return True
+
+
+def _install_file(src, dest, st, progress=None, mode=False, hardlink=False,
+                  dedupe=None):
+    """Puts a copy of file src at dest, see Path.copy.  st is the os.stat
+       result for src."""
+    linked = False
+    if dedupe is not None:
+        crc = GPath(src)._crc(None, st)
+        match = dedupe.find(src, st.st_size, crc)
+        linked = match is not None and _link_file(match._s, dest)
+    if not linked and hardlink:
+        linked = _link_file(src, dest)
+    if linked:
+        if progress:
+            progress(st.st_size)
+    else:
+        _copy_file(src, dest, st, progress, mode)
+    if dedupe is not None:
+        dedupe.add(dest, st.st_size, crc)
+
+
+class DedupeIndex(object):
+    """Index of files by size and CRC, so that when copying a file with the
+       same contents as one already indexed, it can be hard linked to that
+       file instead of storing the data again.  Since CRCs can collide, the
+       files are compared byte for byte before being linked.
+       Note, hard linked files are the same file: changing one changes all
+       of them."""
+
+    __slots__ = ('_files', '_lock')
+
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(map(len, self._files.values()))
+
+    def add(self, path, size=None, crc=None):
+        """Add a file to the index.  The size and crc are looked up if not
+           specified."""
+        path = GPath(path)
+        if size is None or crc is None:
+            st = os.stat(path._s)
+            size = st.st_size
+            crc = path._crc(None, st)
+        with self._lock:
+            files = self._files.setdefault((size, crc), [])
+            if path not in files:
+                files.append(path)
+
+    def addTree(self, path, callback=None, threads=None):
+        """Add all files in directory path and its subdirectories to the
+           index, for example a game's Data folder.  callback and threads
+           are as for crc_many."""
+        entries = [entry for entry in GPath(path).scan() if not entry.isdir]
+        crcs = crc_many(entries, callback, threads)
+        for entry in entries:
+            self.add(entry.path, entry.size, crcs[entry.path])
+
+    def discard(self, path):
+        """Remove a file from the index."""
+        path = GPath(path)
+        with self._lock:
+            for files in self._files.values():
+                if path in files:
+                    files.remove(path)
+
+    def find(self, path, size, crc):
+        """Returns an indexed file with the same contents as path (which has
+           the specified size and crc), or None if there isn't one."""
+        import filecmp
+        with self._lock:
+            candidates = list(self._files.get((size, crc), ()))
+        for candidate in candidates:
+            if candidate == path:
+                continue
+            try:
+                if filecmp.cmp(getNorm(path), candidate._s, shallow=False):
+                    return candidate
+            except OSError:
+                # Removed since being indexed
+                self.discard(candidate)
+        return None
+
+
+def _copy_tree(src, dest, callback=None, threads=None, hardlink=False,
+               dedupe=None):
+    """Implementation of Path.copy for directories.  Like shutil.copytree,
+       dest must not already exist."""
+    os.makedirs(dest)
+    dirs = [(dest, os.stat(src))]
+    files = []
+    stack = [(src, dest)]
+    while stack:
+        srcDir, destDir = stack.pop()
+        for entry in _scandir(srcDir):
+            target = os.path.join(destDir, entry.name)
+            if entry.is_dir():
+                os.mkdir(target)
+                dirs.append((target, entry.stat()))
+                stack.append((entry.path, target))
+            else:
+                files.append((entry.path, target, entry.stat()))
+    progress = _progress_combiner(callback)
+    threads = threads if threads else (os.cpu_count() or 1)
+    if threads <= 1 or len(files) <= 1:
+        for source, target, st in files:
+            _install_file(source, target, st, progress(), True, hardlink,
+                          dedupe)
+    else:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            futures = [executor.submit(_install_file, source, target, st,
+                                       progress(), True, hardlink, dedupe)
+                       for source, target, st in files]
+            for future in futures:
+                # Raise any errors
+                future.result()
+    # Directory times last, since adding files changes them.  Subdirectories
+    # first, for the same reason.
+    for target, st in reversed(dirs):
+        _copy_stat(target, st, True)
 
 
 #------------------------------------------------------------------------------
@@ -113,30 +908,267 @@ def getCase(name):
 def tempdir():
     """Returns Path object for the location where temp files are
        created by default for the system."""
+    import tempfile
     return GPath(tempfile.gettempdir())
 
 
 def makeTempdir(suffix='', prefix='tmp'):
     """Creates a new temporary directory."""
+    import tempfile
     return GPath(tempfile.mkdtemp(suffix, prefix))
 
 
-def _onerror(func, path, exc_info):
-    """shutil error handler: remove RO flag"""
-    if not os.access(path, os.W_OK):
-        os.chmod(path, stat.S_IWUSR | stat.S_IWOTH)
-        func(path)
+_WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+def _readonly_mode(mode, ro):
+    """Returns the permission bits of mode, with the write bits cleared if
+       ro is True, otherwise with the owner write bit set."""
+    mode = stat.S_IMODE(mode)
+    if ro:
+        return mode & ~_WRITE_BITS
+    return mode | stat.S_IWUSR
+
+
+def _is_readonly(st):
+    """Read only status of a file from its os.stat result: True if the owner
+       write bit isn't set, which is also how Windows reports the read only
+       attribute.  Directories are never considered read only."""
+    return stat.S_ISREG(st.st_mode) and not st.st_mode & stat.S_IWUSR
+
+
+def _set_readonly_tree(top, ro, threads=None):
+    """Implementation of Path.setReadOnly for directories.  Uses the modes
+       read while scanning to only change the files that need it, then
+       changes those using a pool of threads.  Directories are left alone,
+       like getReadOnly they're never read only (and on POSIX, a tree with
+       read only directories can't be removed)."""
+    paths = []
+    modes = []
+    stack = [top]
+    while stack:
+        for entry in _scandir(stack.pop()):
+            if entry.is_symlink():
+                continue
+            mode = entry.stat(follow_symlinks=False).st_mode
+            if stat.S_ISDIR(mode):
+                stack.append(entry.path)
+            elif stat.S_ISREG(mode):
+                newMode = _readonly_mode(mode, ro)
+                if newMode != stat.S_IMODE(mode):
+                    paths.append(entry.path)
+                    modes.append(newMode)
+    threads = threads if threads else (os.cpu_count() or 1)
+    if threads <= 1 or len(paths) <= 1:
+        for path, mode in zip(paths, modes):
+            os.chmod(path, mode)
     else:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            # Consume the results, to raise any errors
+            for result in executor.map(os.chmod, paths, modes):
+                pass
+
+
+def _make_writable(path):
+    """Sets the owner write bit of path (clearing the read-only flag on
+       Windows).  Returns its old permission bits, or None if it was already
+       writable (or a symlink) so nothing changed."""
+    try:
+        mode = os.lstat(path).st_mode
+        if stat.S_ISLNK(mode) or mode & stat.S_IWUSR:
+            return None
+        os.chmod(path, stat.S_IMODE(mode) | stat.S_IWUSR)
+    except OSError:
+        return None
+    return stat.S_IMODE(mode)
+
+
+def _retry_writable(func, path):
+    """Calls func(path), clearing the read-only flag of path and trying again
+       if that fails with a PermissionError.  If it fails again, the mode of
+       path is put back as it was."""
+    try:
+        func(path)
+        return
+    except PermissionError:
+        mode = _make_writable(path)
+        if mode is None:
+            raise
+    try:
+        func(path)
+    except OSError:
+        try:
+            os.chmod(path, mode)
+        except OSError:
+            pass
+        raise
+
+
+def _remove_tree(top):
+    """Removes directory top and everything in it, clearing read-only flags
+       as needed.  Each directory is listed once, and all of its files
+       removed in one batch before moving on to its subdirectories.  If that
+       fails, the directories left keep the modes they had."""
+    stack = [(top, False, None)]   # (directory, emptied, mode to restore)
+    pop = stack.pop
+    push = stack.append
+    try:
+        while stack:
+            dirname, emptied, mode = pop()
+            if emptied:
+                try:
+                    _retry_writable(os.rmdir, dirname)
+                except OSError:
+                    push((dirname, True, mode))
+                    raise
+                continue
+            # On POSIX, removing the entries of a directory needs write
+            # permission on the directory itself
+            push((dirname, True, _make_writable(dirname)))
+            for entry in list(_scandir(dirname)):
+                if entry.is_dir(follow_symlinks=False):
+                    push((entry.path, False, None))
+                else:
+                    _retry_writable(os.remove, entry.path)
+    except OSError:
+        for dirname, emptied, mode in stack:
+            if mode is not None:
+                try:
+                    os.chmod(dirname, mode)
+                except OSError:
+                    pass
         raise
 
 
+def _prune_empty(top):
+    """Removes all empty directories in top, including directories that
+       only contain empty directories, and top itself if it ends up empty.
+       Each directory is listed once, then the empty ones are removed deepest
+       first.  Never removes anything outside of top."""
+    dirs = []       # (directory, index of its parent in dirs)
+    keep = []       # True for directories with files, or subdirectories kept
+    stack = [(top, -1)]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        dirname, parent = pop()
+        index = len(dirs)
+        dirs.append((dirname, parent))
+        keep.append(False)
+        try:
+            entries = list(_scandir(dirname))
+        except OSError:
+            keep[index] = True
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                push((entry.path, index))
+            else:
+                keep[index] = True
+    # Subdirectories always come after their parent in dirs, so going in
+    # reverse handles every subdirectory before its parent
+    for index in range(len(dirs) - 1, -1, -1):
+        dirname, parent = dirs[index]
+        if not keep[index]:
+            try:
+                _retry_writable(os.rmdir, dirname)
+                continue
+            except OSError:
+                pass
+        if parent >= 0:
+            keep[parent] = True
+
+
+class _BackgroundRemover(object):
+    """Removes directory trees using a pool of worker threads."""
+
+    __slots__ = ('_executor', '_futures', '_lock')
+
+    WORKERS = 2
+
+    def __init__(self):
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def remove(self, path):
+        """Removes directory path in the background.  It's first renamed to a
+           'tombstone' name in the same directory, so path can be reused
+           right away.  If the rename fails, path is removed right now."""
+        import binascii
+        import concurrent.futures
+        head, tail = os.path.split(path)
+        tombstone = os.path.join(head, '.%s.%s.deleting' % (
+            tail, binascii.hexlify(os.urandom(4)).decode('ascii')))
+        try:
+            os.rename(path, tombstone)
+        except OSError:
+            _remove_tree(path)
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    _BackgroundRemover.WORKERS)
+            try:
+                future = self._executor.submit(_remove_tree, tombstone)
+            except RuntimeError:
+                # The interpreter is shutting down, no new threads
+                future = None
+            else:
+                self._futures[future] = tombstone
+        if future is None:
+            _remove_tree(tombstone)
+            return
+        # Not while holding the lock: if already finished, _done is called
+        # right away, and takes the lock itself
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        """Forget a removal once finished, unless it failed."""
+        if future.exception() is None:
+            with self._lock:
+                self._futures.pop(future, None)
+
+    def wait(self, timeout=None):
+        """Waits for the removals started so far to finish.  Returns a list
+           of the tombstone names that couldn't be removed completely, or are
+           still being removed if timeout seconds passed first."""
+        with self._lock:
+            futures = dict(self._futures)
+        if not futures:
+            return []
+        import concurrent.futures
+        done, pending = concurrent.futures.wait(futures, timeout)
+        failed = []
+        with self._lock:
+            for future, tombstone in futures.items():
+                if future in pending or future.exception() is not None:
+                    failed.append(tombstone)
+                    # A pending one may have finished and been dropped by
+                    # _done since
+                    self._futures.pop(future, None)
+        return failed
+
+
+_remover = _BackgroundRemover()
+
+
+def waitForRemovals(timeout=None):
+    """Waits for directories being removed in the background (see
+       Path.remove) to finish.  Returns a list of those that couldn't be
+       removed completely, or are still being removed after timeout
+       seconds."""
+    return _remover.wait(timeout)
+
+
 @make_constants()
 class Path(object):
     """A file path.  May be a directory or filename, a full path or relative
        path.  Can include the drive or not.  Supports Pickling."""
 
     __slots__ = ('_s','_cs','_sroot','_csroot','_shead','_stail','_ext',
-                 '_cext', '_sbody','_csbody')
+                 '_cext', '_sbody','_csbody','__weakref__')
 
     def __init__(self, name):
         """Initialize."""
@@ -152,14 +1184,29 @@ class Path(object):
         return self._s
 
     def __setstate__(self,norm):
-        """Used by unpickler to create object.  Doubles as an initializer."""
+        """Used by unpickler to create object.  Doubles as an initializer.
+           Only the path and case normalized path are set here, the other
+           slots are filled in by __getattr__ when first used."""
         self._s = norm
-        self._cs = os.path.normcase(self._s)
-        self._sroot, self._ext = os.path.splitext(self._s)
-        self._csroot, self._cext = os.path.splitext(self._cs)
-        self._shead, self._stail = os.path.split(self._s)
-        self._sbody = os.path.basename(self._sroot)
-        self._csbody = os.path.basename(self._csroot)
+        self._cs = os.path.normcase(norm)
+
+    def __getattr__(self, attr):
+        """Only called when a slot hasn't been set yet.  Calculates the value
+           for the slot (and any related slots), then stores it so later
+           lookups don't end up here."""
+        if attr == '_sroot' or attr == '_ext':
+            self._sroot, self._ext = os.path.splitext(self._s)
+        elif attr == '_csroot' or attr == '_cext':
+            self._csroot, self._cext = os.path.splitext(self._cs)
+        elif attr == '_shead' or attr == '_stail':
+            self._shead, self._stail = os.path.split(self._s)
+        elif attr == '_sbody':
+            self._sbody = os.path.basename(self._sroot)
+        elif attr == '_csbody':
+            self._csbody = os.path.basename(self._csroot)
+        else:
+            raise AttributeError("'Path' object has no attribute '%s'" % attr)
+        return getattr(self, attr)
 
     def __len__(self):
         """Length of path string."""
@@ -304,6 +1351,7 @@ class Path(object):
             encoded in the specified encoding.  This would be useful for
             example when used with subprocess.Popen, which encodes to ASCII
             automatically before passing to the command line."""
+        import tempfile
         path = tempfile.mktemp(prefix='WryeBash_', suffix='.tmp'+self._ext)
         path = Path(path)
         if encodingSafe:
@@ -315,21 +1363,29 @@ class Path(object):
                 path = Path(path)
         return path
 
-    @property
-    def size(self):
-        """Size of file or directory."""
-        if os.path.isdir(self._s):
-            return sum(sum(map(os.path.getsize,
-                               map(lambda z: os.path.join(root,
-                                                          dir,
-                                                          z),
-                                   files)
-                                )
-                           )
-                       for root, dir, files in os.walk(self._s)
-                       )
-        else:
-            return os.path.getsize(self._s)
+    def getsize(self, callback=None, threads=None, cache=None):
+        """Size of file or directory.  For a directory, this is the total
+           size of all files in it and its subdirectories.
+             callback - called with the running total as each directory is
+                 scanned.  With threads, it's called from the worker threads.
+             threads - scan the subdirectories using this many threads.
+             cache - a DirCache of directory listings, so asking again only
+                 needs to stat the files, not list unchanged directories.
+                 This scans in the calling thread, ignoring threads, and
+                 calls callback once with the total."""
+        st = os.stat(self._s)
+        if not stat.S_ISDIR(st.st_mode):
+            return st.st_size
+        if cache is None:
+            return _tree_size(self._s, callback, threads)
+        size = sum(entryStat.st_size for path, entryStat, isdir
+                   in _walk_cached(self._s, st, cache)
+                   if not stat.S_ISDIR(entryStat.st_mode))
+        if callback:
+            callback(size)
+        return size
+
+    size = property(getsize, doc='Size of file or directory.')
 
     @property
     def atime(self):
@@ -343,25 +1399,23 @@ class Path(object):
 
     #--mtime
     def getmtime(self,maxMTime=False):
-        if os.path.isdir(self._s) and maxMTime:
-            mtime = max(
-                map(os.path.getmtime,
-                    itertools.chain(
-                        os.path.join(root, x) for x in itertools.chain(dirs,
-                                                                        files)
-                        for root, dir, files in os.walk(self._s)
-                        )
-                   )
-            )
-        else:
-            mtime = os.path.getmtime(self._s)
+        """Time file was last modified.  If maxMTime is True and this is a
+           directory, returns the time of the newest file or directory in
+           it (or of the directory itself, if empty)."""
+        st = os.stat(self._s)
+        mtime = st.st_mtime
+        if maxMTime and stat.S_ISDIR(st.st_mode):
+            newest = _max_mtime(self._s, st)
+            if newest is not None:
+                mtime = newest
         mtime = int(mtime)
         if mtime <= 0:
             #--Y2038 bug - os.path.getmtime can't handle years past
             #  the Unix epoch, reset to a random time 10 days within
             #  1/1/2037
+            import random
             mtime = time.mktime((2037, 1, 1, 0, 0, 0, 3, 1, 0))
-            mtime += random.randint(10 * 24 * 60 * 60) # 10 days in seconds
+            mtime += random.randint(0, 10 * 24 * 60 * 60) # 10 days in seconds
             os.utime(self._s, (os.path.getatime(self._s), mtime))
         return mtime
 
@@ -370,6 +1424,15 @@ class Path(object):
 
     mtime = property(getmtime, setmtime, doc='Time file was last modified.')
 
+    def hasNewer(self, mtime):
+        """True if this file was modified after mtime, or for a directory, if
+           anything in it was.  Stops looking at the first newer item."""
+        st = os.stat(self._s)
+        if not stat.S_ISDIR(st.st_mode):
+            return st.st_mtime > mtime
+        newest = _max_mtime(self._s, st, mtime)
+        return newest is not None and newest > mtime
+
     @property
     def stat(self):
         """File stats from os.stat."""
@@ -407,16 +1470,9 @@ class Path(object):
 
     @property
     def crc(self):
-        """Calculates CRC for self."""
-        size = os.path.getsize(self._s)
-        crc = 0
-        crc32 = binascii.crc32
-        with open(self._s, 'rb') as ins:
-            insTell = ins.tell
-            insRead = ins.read
-            while insTell() < size:
-                crc = crc32(insRead(2097152), crc) # 2MB at a time
-        return crc & 0xFFFFFFFF
+        """Calculates CRC for self.  The result is cached, so unchanged files
+           are only read once."""
+        return self._crc()
 
     @property
     def exists(self):
@@ -448,18 +1504,51 @@ class Path(object):
         """Calculates CRC, but allows for a callback for UI feedback.
            callback should be a callable that will be called with how many
            bytes have been read in."""
-        size = os.path.getsize(self._s)
+        return self._crc(callback)
+
+    def _crc(self, callback=None, st=None):
+        """Implementation of crc and crc_callback.  st may be the already
+           known os.stat result for this file."""
+        if st is None:
+            st = os.stat(self._s)
+        size = st.st_size
+        crc = crcCache.get(self._cs, size, st.st_mtime_ns)
+        if crc is not None:
+            if callback:
+                callback(size)
+            return crc
+        from binascii import crc32
         crc = 0
-        crc32 = binascii.crc32
+        pos = 0
         with open(self._s, 'rb') as ins:
-            insTell = ins.tell
-            insRead = ins.read
-            pos = 0
-            while pos < size:
-                crc = crc32(insRead(2097152), crc) # 2MB at a time
-                pos = insTell()
-                callback(pos)
-        return crc & 0xFFFFFFFF
+            if size >= _CRC_MMAP_SIZE:
+                # Large file, map it into memory rather than copying it in
+                crc, pos = _crc_mapped(ins, callback)
+            if pos < size:
+                # Read the rest (everything for small files) into the same
+                # buffer each time, to avoid allocating a new bytes object
+                # per chunk
+                ins.seek(pos)
+                buffer = bytearray(min(size - pos, _CRC_CHUNK) or 1)
+                with memoryview(buffer) as view:
+                    insReadinto = ins.readinto
+                    while pos < size:
+                        read = insReadinto(buffer)
+                        if not read:
+                            break
+                        crc = crc32(view[:read], crc)
+                        pos += read
+                        if callback:
+                            callback(pos)
+        crc &= 0xFFFFFFFF
+        crcCache.set(self._cs, size, st.st_mtime_ns, crc)
+        return crc
+
+    def crc_tree(self, callback=None, threads=None):
+        """Calculates the CRC of every file in this directory and its
+           subdirectories.  See crc_many."""
+        return crc_many((entry for entry in self.scan() if not entry.isdir),
+                        callback, threads)
 
     def join(*args):
         """Joins self with path elements, using path seperators."""
@@ -469,7 +1558,7 @@ class Path(object):
         """Returns files/directories in this directory."""
         if not os.path.exists(self._s):
             return []
-        return map(GPath, os.listdir(self._s))
+        return GPathMany(os.listdir(self._s))
 
     def walk(self, topdown=True, onerror=None, relative=False):
         """Like os.walk"""
@@ -477,13 +1566,23 @@ class Path(object):
             start = len(self._s)
             for root, dirs, files in os.walk(self._s, topdown, onerror):
                 yield (GPath(root[start:]),
-                       map(GPath,dirs),
-                       map(GPath,files))
+                       GPathMany(dirs),
+                       GPathMany(files))
         else:
             for root, dirs, files in os.walk(self._s, topdown, onerror):
                 yield (GPath(root),
-                       map(GPath,dirs),
-                       map(GPath,files))
+                       GPathMany(dirs),
+                       GPathMany(files))
+
+    def scan(self, recursive=True, topdown=True, onerror=None):
+        """Like walk, but using os.scandir, yielding a PathEntry for every
+           file and directory in this directory (and its subdirectories if
+           recursive is True).  The entries carry the stat information read
+           while scanning, so using it doesn't cost another syscall.  If
+           topdown is True, directories are yielded before their contents,
+           otherwise after.  onerror is called with the OSError if a
+           directory can't be scanned."""
+        return _scan(self._s, recursive, topdown, onerror)
 
     def split(self):
         """Splits the path along path seperators.
@@ -529,32 +1628,36 @@ class Path(object):
         return (os.path.join(parent, child[len(parent):].lstrip(os.path.sep))
                 == child)
 
-    def setReadOnly(self, ro):
-        """Sets status of read only flag."""
-        if ro:
-            flag = stat.S_IRUSR | stat.S_IROTH
-        else:
-            flag = stat.S_IWUSR | stat.S_IWOTH
-        if not os.path.isdir(self._s):
-            os.chmod(self._s, flag)
+    def setReadOnly(self, ro, threads=None):
+        """Sets status of read only flag.  For a directory, sets it for
+           everything in the directory and its subdirectories.  Only the
+           write permission bits are changed, and files already in the
+           right state are left alone.  threads - number of threads to use
+           for changing files in a directory, defaults to the number of
+           CPUs."""
+        st = os.stat(self._s)
+        if not stat.S_ISDIR(st.st_mode):
+            mode = _readonly_mode(st.st_mode, ro)
+            if mode != stat.S_IMODE(st.st_mode):
+                os.chmod(self._s, mode)
         else:
-            for root, dirs, files in os.walk(self._s):
-                for path in itertools.chain(dirs, files):
-                    os.chmod(os.path.join(root, path), flag)
+            _set_readonly_tree(self._s, ro, threads)
 
     def getReadOnly(self):
-        """Gets status of read only flag."""
-        if os.path.exists(self._s):
-            if os.path.isfile(self._s):
-                try:
-                    with open(self._s, 'ab'):
-                        return False
-                except PermissionError:
-                    return True
-        return False
+        """Gets status of read only flag.  Always False for directories."""
+        try:
+            return _is_readonly(os.stat(self._s))
+        except OSError:
+            return False
 
     readonly = property(getReadOnly, setReadOnly, doc='Read-only status.')
 
+    def readonly_tree(self):
+        """Returns a dictionary mapping every file in this directory and its
+           subdirectories to its read only status, using one scan."""
+        return {entry.path: _is_readonly(entry.stat)
+                for entry in self.scan() if not entry.isdir}
+
     def open(self, *args, **kwds):
         """Open file for read/write, etc.  Accepts encoding argument."""
         if self._shead and not os.path.exists(self._shead):
@@ -566,11 +1669,13 @@ class Path(object):
         if not os.path.exists(self._s):
             os.makedirs(self._s)
 
-    def remove(self, emptyOnly=False):
+    def remove(self, emptyOnly=False, background=False):
         """Smart remove.  Removes a file or directory tree, clearing the
            read-only flag if necessary.  If emptyOnly is True, then if path
            is a directory, only removes empty subdirectories and path if no
            files are present.  No files will be removed in this case.
+           If background is True, a directory tree is removed by a worker
+           thread, see removetree.
            For standard Python file/directory remove functions, see:
               removefile, removedir, removedirs, removetree."""
         if os.path.exists(self._s):
@@ -582,25 +1687,10 @@ class Path(object):
                     os.remove(self._s)
             elif emptyOnly:
                 # Directory, recursively clean out empty directories
-                roCleared = False
-                for root, dirs, files in os.walk(self._s):
-                    if not files and not dirs:
-                        try:
-                            os.removedirs(root)
-                        except PermissionError:
-                            if roCleared:
-                                raise
-                            self.setReadOnly(False)
-                            roCleared = True
-                            os.removedirs(root)
-                # os.removedirs may have removed parent directories though, so
-                # restore those if needed, but keep this directory deleted
-                if not os.path.exists(self._s):
-                    os.makedirs(self._s)
-                    os.removedir(self._s)
+                _prune_empty(self._s)
             else:
                 # Directory, recursively remove everything
-                shutil.rmtree(self._s, onerror=_onerror)
+                self.removetree(background)
 
     def removefile(self):
         """Removes a file, no error/read-only checking."""
@@ -615,13 +1705,20 @@ class Path(object):
            no error/read-only checking."""
         os.removedirs(self._s)
 
-    def removetree(self):
-        """Removes directory and subdirectoris and files recursively."""
-        shutil.rmtree(self._s, onerror=_onerror)
+    def removetree(self, background=False):
+        """Removes directory and subdirectoris and files recursively.  If
+           background is True, the directory is renamed and then removed by a
+           worker thread, so this returns right away.  Use waitForRemovals to
+           wait for these to finish."""
+        if background:
+            _remover.remove(self._s)
+        else:
+            _remove_tree(self._s)
 
     def start(self, exeArgs=None):
         """Starts a file as if doubleclicked in explorer."""
         if self._cext == '.exe':
+            import subprocess
             if not exeArgs:
                 subprocess.Popen([self._s], close_fds=True)
             else:
@@ -629,18 +1726,35 @@ class Path(object):
         else:
             os.startfile(self._s)
 
-    def copy(self, dest):
-        """Copies self to destination."""
+    def copy(self, dest, callback=None, threads=None, hardlink=False,
+             dedupe=None):
+        """Copies self to destination, keeping modification times.  For
+           directories, dest must not exist yet, and the files are copied
+           using a pool of threads.
+             callback - called with the number of bytes copied so far.  For
+                 directories, it's called from the worker threads.
+             threads - number of threads to use, defaults to the number of
+                 CPUs.
+             hardlink - hard link the files instead of copying them, where
+                 the source and destination are on the same file system.
+             dedupe - a DedupeIndex.  Files with the same contents as an
+                 indexed file are hard linked to that file instead of being
+                 copied, and the copied files are added to the index."""
         dest = GPath(dest)
         if self._cs == dest._cs:
             return
-        if os.path.isdir(self._s):
-            shutil.copytree(self._s, dest._s)
+        st = os.stat(self._s)
+        if stat.S_ISDIR(st.st_mode):
+            _copy_tree(self._s, dest._s, callback, threads, hardlink,
+                       dedupe)
+            crcCache.invalidate(dest._cs, tree=True)
         else:
             if dest._shead and not os.path.exists(dest._shead):
                 os.makedirs(dest._shead)
-            shutil.copyfile(self._s, dest._s)
-            os.utime(dest._s, (os.path.getatime(dest._s), self.mtime))
+            _install_file(self._s, dest._s, st, callback, False, hardlink,
+                          dedupe)
+            # mtime is copied too, so the old entry for dest could look valid
+            crcCache.invalidate(dest._cs)
 
     def move(self, dest):
         """Moves file to destination."""
@@ -651,11 +1765,14 @@ class Path(object):
             os.makedirs(dest._shead)
         elif os.path.exists(dest._s) and os.path.isfile(self._s):
             os.remove(dest._s)
+        import shutil
         try:
             shutil.move(self._s, dest._s)
         except OSError:
             self.readonly = False
             shutil.move(self._s, dest._s)
+        crcCache.invalidate(self._cs, tree=True)
+        crcCache.invalidate(dest._cs, tree=True)
 
     def tempMoveTo(self, dest):
         """Temporarily moves file to destination.  Use with the 'with' statement
@@ -678,6 +1795,7 @@ class Path(object):
         else:
             with open(self._s, 'wb'):
                 pass
+        crcCache.invalidate(self._cs)
 
     def setcwd(self):
         """Set current working directory to self."""
@@ -699,7 +1817,7 @@ class PathUnion(object):
            and no file uses the first directory of the union, MODE_TIMESTAMP
            uses the oldest file."""
 
-    __slots__ = ('dirs','_mode')
+    __slots__ = ('dirs','_mode','_index')
 
     MODE_ORDER = 1
     MODE_REVERSE = 2
@@ -709,7 +1827,9 @@ class PathUnion(object):
         self.dirs = [GPath(x) for x in names]
         self._mode = mode
         if mode & PathUnion.MODE_REVERSE:
-            self._dirs.reverse()
+            self.dirs.reverse()
+        # Names in each subdirectory of the union, see _lookup
+        self._index = {}
 
     def __repr__(self):
         """Representaion of a PathUnion"""
@@ -719,10 +1839,117 @@ class PathUnion(object):
         """Returns list of filenames/dirnames in this union."""
         return set(itertools.chain(*(dirname.list() for dirname in self.dirs)))
 
+    def refresh(self):
+        """Forget all indexed names.  Needed after adding a file to one
+           directory of the union when another one already has a file by
+           that name, see _lookup."""
+        self._index.clear()
+
     def join(self, *args):
         """Retrun Path object from joining directory with names.  How
            the true path is decided by creation mode."""
         norms = [getNorm(x) for x in args]
+        rel = os.path.join(*norms) if norms else ''
+        head, tail = os.path.split(rel)
+        if (tail and not os.path.isabs(rel) and tail != os.pardir
+                and os.pardir not in rel.split(os.sep)):
+            match = self._lookup(head, tail)
+            if match is not None:
+                return GPath(os.path.join(match._s, rel))
+        else:
+            # Not a plain relative path, search the hard way
+            match = self._search(norms)
+            if match:
+                return GPath(match)
+        # None exist, use first directory to create
+        return self.dirs[0].join(*norms)
+
+    def _lookup(self, head, tail):
+        """Returns the directory of the union whose head directory has the
+           winning tail, or None if none of them do.  The first lookup in a
+           head lists that directory in every member of the union, indexing
+           which members have each name.  After that, a name in the index only
+           needs its candidates stat'd: the first one for MODE_ORDER, all of
+           them for MODE_TIMESTAMP.  For a name not in the index, or a
+           candidate that's gone, the head directories are stat'd and listed
+           again if any changed.  So a file added to another member, for a
+           name already indexed, isn't seen until refresh is called."""
+        key = os.path.normcase(head)
+        name = os.path.normcase(tail)
+        cached = self._index.get(key)
+        if cached is not None:
+            candidates = cached[1].get(name)
+            if candidates:
+                match = self._pick(candidates, os.path.join(head, tail))
+                if match is not None:
+                    return match
+            stamps = self._stamps(head)
+            if stamps == cached[0]:
+                return None
+        else:
+            stamps = self._stamps(head)
+        names = self._indexHead(head, stamps)
+        self._index[key] = (stamps, names)
+        candidates = names.get(name)
+        if not candidates:
+            return None
+        return self._pick(candidates, os.path.join(head, tail))
+
+    def _stamps(self, head):
+        """The mtimes of the head directory in every member of the union."""
+        stamps = []
+        for dirname in self.dirs:
+            try:
+                stamps.append(os.stat(os.path.join(dirname._s, head))
+                              .st_mtime_ns)
+            except OSError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def _indexHead(self, head, stamps):
+        """Returns a dictionary of every name in the head directory of the
+           union's members, to the list of members that have it (in the
+           union's order)."""
+        names = {}
+        normcase = os.path.normcase
+        for dirname, stamp in zip(self.dirs, stamps):
+            if stamp is None:
+                continue
+            try:
+                entries = os.listdir(os.path.join(dirname._s, head))
+            except OSError:
+                continue
+            for entry in entries:
+                names.setdefault(normcase(entry), []).append(dirname)
+        return names
+
+    def _pick(self, candidates, rel):
+        """Returns the winner among the members of the union with rel, like
+           _search does, or None if one of them doesn't have it anymore."""
+        if not self._mode & PathUnion.MODE_TIMESTAMP:
+            dirname = candidates[0]
+            if os.path.exists(os.path.join(dirname._s, rel)):
+                return dirname
+            return None
+        # Files can be modified in place, without changing the mtime of
+        # their directory, so their mtimes are always checked
+        reverse = self._mode & PathUnion.MODE_REVERSE
+        match = None
+        for dirname in candidates:
+            try:
+                mtime = os.stat(os.path.join(dirname._s, rel)).st_mtime
+            except OSError:
+                return None
+            # Same tie breaking as _search
+            if (match is None or (reverse and not newest < mtime)
+                    or (not reverse and newest < mtime)):
+                match = dirname
+                newest = mtime
+        return match
+
+    def _search(self, norms):
+        """Finds the matching path for norms by checking every directory of
+           the union."""
         if self._mode & PathUnion.MODE_TIMESTAMP:
             # Newest/oldest file returned
             if self._mode & PathUnion.MODE_REVERSE:
@@ -744,16 +1971,14 @@ class PathUnion(object):
                 full = os.path.join(dirname._s, *norms)
                 if os.path.exists(full):
                     match = getmatch(match,full)
-            if match:
-                return GPath(match)
+            return match
         else: # MODE_ORDER
             # First/last match returned
             for dirname in self.dirs:
                 full = os.path.join(dirname._s, *norms)
                 if os.path.exists(full):
-                    return GPath(full)
-        # None exist, use first directory to create
-        return self.dirs[0].join(*norms)
+                    return full
+        return None
 
 
 # Win32API --------------------------------------------------------------------
@@ -770,6 +1995,7 @@ def _LOWORD(dw):
 def GetFileVersionInfo(fileName):
     # Optimize doesn't like when the next 3 declarations are in the global
     # global scope, ends up in an infinite recursive optimization loop
+    import ctypes
     from ctypes.wintypes import DWORD
     class FFI(ctypes.Structure):
         # VS_FIXEDFILEINFO
@@ -803,23 +2029,27 @@ def GetFileVersionInfo(fileName):
     return {x[0]:getattr(r,x[0]) for x in FFI._fields_}
 
     
-_csidls = {
-    # Only reproduce a few of the shell folders here, even most of these won't
-    # be used.
-    'DESKTOP': 0,
-    'PROGRAMS': 2,
-    'PERSONAL': 5,
-    'FAVORITES': 6,
-    'STARTUP': 7,
-    'RECENT': 8,
-    'SENDTO': 9,
-    'STARTMENU': 11,
-    'APPDATA': 26,
-    'LOCAL_APPDATA': 28,
+#--Shell folders: Desktop, AppData, etc.  These are only looked up when first
+#  used (see __getattr__), then kept as module attributes.  On Windows they
+#  come from SHGetFolderPath, elsewhere from the XDG base and user
+#  directories: name -> (CSIDL, XDG directory, subdirectory of that).
+_shellFolders = {
+    'Desktop': (0, 'DESKTOP', ''),
+    'Programs': (2, 'DATA', 'applications'),
+    'Personal': (5, 'DOCUMENTS', ''),
+    'Favorites': (6, 'HOME', ''),
+    'Startup': (7, 'CONFIG', 'autostart'),
+    'Recent': (8, 'DATA', 'recent'),
+    'SendTo': (9, 'HOME', ''),
+    'StartMenu': (11, 'DATA', 'applications'),
+    'AppData': (26, 'CONFIG', ''),
+    'LocalAppData': (28, 'DATA', ''),
     }
 
 
-def _shell_path(name):
+def _shell_path(csidl):
+    # Not at the top, it fails to import on some non-Windows Pythons
+    import ctypes.wintypes
     SHGetFolderPath = ctypes.windll.shell32.SHGetFolderPathW
     SHGetFolderPath.argtypes = [ctypes.wintypes.HWND,
                                 ctypes.c_int,
@@ -827,25 +2057,119 @@ def _shell_path(name):
                                 ctypes.wintypes.DWORD,
                                 ctypes.wintypes.LPCWSTR]
     path_buf = ctypes.create_unicode_buffer(ctypes.wintypes.MAX_PATH)
-    error = SHGetFolderPath(0, _csidls.get(name), 0, 0, path_buf)
+    error = SHGetFolderPath(0, csidl, 0, 0, path_buf)
     return GPath(path_buf.value)
 
 
-Desktop = _shell_path('DESKTOP')
-AppData = _shell_path('APPDATA')
-LocalAppData = _shell_path('LOCAL_APPDATA')
-Favorites = _shell_path('FAVORITES')
-StartMenu = _shell_path('STARTMENU')
-Programs = _shell_path('PROGRAMS')
-Startup = _shell_path('STARTUP')
-Personal = _shell_path('PERSONAL')
-Recent = _shell_path('RECENT')
-SendTo = _shell_path('SENDTO')
+def _xdg_path(kind):
+    """The XDG directory kind (HOME, CONFIG, DATA, or a user directory like
+       DESKTOP), see the XDG Base Directory Specification and xdg-user-dirs.
+    """
+    home = os.path.expanduser('~')
+    if kind == 'HOME':
+        return home
+    elif kind == 'CONFIG':
+        return os.environ.get('XDG_CONFIG_HOME') or os.path.join(home,
+                                                                 '.config')
+    elif kind == 'DATA':
+        return os.environ.get('XDG_DATA_HOME') or os.path.join(
+            home, '.local', 'share')
+    # User directory, XDG_DESKTOP_DIR="$HOME/Desktop" in user-dirs.dirs
+    var = 'XDG_%s_DIR' % kind
+    path = os.environ.get(var)
+    if not path:
+        try:
+            with open(os.path.join(_xdg_path('CONFIG'), 'user-dirs.dirs'),
+                      encoding='utf-8') as ins:
+                for line in ins:
+                    key, sep, value = line.strip().partition('=')
+                    if key == var and sep:
+                        path = value.strip('"').replace('$HOME', home)
+        except OSError:
+            pass
+    return path or os.path.join(home, kind.capitalize())
+
 
+def _shell_folder(name):
+    csidl, kind, subdir = _shellFolders[name]
+    if os.name == 'nt':
+        return _shell_path(csidl)
+    return GPath(os.path.join(_xdg_path(kind), subdir))
+
+
+def _startupinfo():
+    """Startupinfo - so subprocess.Popen can launch things with no cmd.exe
+       window."""
+    if os.name != 'nt':
+        return None
+    import subprocess
+    info = subprocess.STARTUPINFO()
+    info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return info
+
+
+def __getattr__(name):
+    """Looks up the shell folders and startupinfo when first used."""
+    if name == 'startupinfo':
+        value = _startupinfo()
+    elif name in _shellFolders:
+        value = _shell_folder(name)
+    else:
+        raise AttributeError('module %r has no attribute %r'
+                             % (__name__, name))
+    globals()[name] = value
+    return value
+
+
+if sys.version_info < (3, 7):
+    # No module __getattr__, so look them all up now
+    for _name in ['startupinfo'] + list(_shellFolders):
+        __getattr__(_name)
+    del _name
+
+
+# scandir emulation -----------------------------------------------------------
+# For Python versions without os.scandir, and no backport installed.
+if _scandir is None:
+    class _DirEntry(object):
+        """Minimal os.DirEntry equivalent, calls os.stat when needed."""
+        __slots__ = ('name', 'path', '_stat', '_lstat')
+
+        def __init__(self, top, name):
+            self.name = name
+            self.path = os.path.join(top, name)
+            self._stat = None
+            self._lstat = None
+
+        def stat(self, follow_symlinks=True):
+            if not follow_symlinks:
+                if self._lstat is None:
+                    self._lstat = os.lstat(self.path)
+                return self._lstat
+            if self._stat is None:
+                self._stat = os.stat(self.path)
+            return self._stat
+
+        def is_dir(self, follow_symlinks=True):
+            try:
+                return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+            except OSError:
+                return False
+
+        def is_file(self, follow_symlinks=True):
+            try:
+                return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+            except OSError:
+                return False
+
+        def is_symlink(self):
+            try:
+                return stat.S_ISLNK(self.stat(False).st_mode)
+            except OSError:
+                return False
 
-# Clean up a little
-del _shell_path
-del _csidls
+    def _scandir(path='.'):
+        return (_DirEntry(path, name) for name in os.listdir(path))
 
 
 bind_all(globals(), stoplist=['_gpaths'])
@@ -0,0 +1,187 @@
+# GPL License and Copyright Notice ============================================
+#  This file is part of Wrye Bash.
+#
+#  Wrye Bash is free software; you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 2 of the License, or (at your option)
+#  any later version.
+#
+#  Wrye Bash is distributed in the hope that it will be useful, but WITHOUT ANY
+#  WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#  details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  Wrye Bash; if not, write to the Free Software Foundation, Inc.,
+#  59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#  Wrye Bash copyright (C) 2005-2009 Wrye
+#
+# =============================================================================
+
+
+"""This module contains Tracer, for timing the phases of starting up and the
+   modules imported during each, and checking the total against a time
+   budget.  Unlike python -X importtime, it also works for the frozen app."""
+
+
+# Imports ---------------------------------------------------------------------
+#--Standard
+import sys
+import time
+import json
+import builtins
+import importlib.util
+
+
+class Tracer(object):
+    """Records when each phase of startup begins and ends, and (once
+       traceImports is called) how long each newly imported module took to
+       load.  Times are in seconds since start."""
+
+    __slots__ = ('start', 'phases', 'imports', '_current', '_stack',
+                 '_import')
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.phases = []    # [name, begin, end]
+        self.imports = []   # [name, phase, begin, total, self time]
+        self._current = None
+        self._stack = []    # Nested imports being timed: [children time]
+        self._import = None
+
+    def now(self):
+        return time.perf_counter() - self.start
+
+    def begin(self, name):
+        """Starts phase name, ending the current one."""
+        now = self.now()
+        if self._current:
+            self._current[2] = now
+        self._current = [name, now, None]
+        self.phases.append(self._current)
+
+    def end(self):
+        """Ends the current phase."""
+        if self._current:
+            self._current[2] = self.now()
+            self._current = None
+
+    def traceImports(self):
+        """Starts timing imports, by wrapping __import__."""
+        if self._import is not None:
+            return
+        self._import = builtins.__import__
+        builtins.__import__ = self._traced_import
+
+    def stopImports(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _traced_import(self, name, globals=None, locals=None, fromlist=(),
+                       level=0):
+        modules = sys.modules
+        count = len(modules)
+        if level == 0 and name in modules and not fromlist:
+            # Already imported, the common case
+            return self._import(name, globals, locals, fromlist, level)
+        stack = self._stack
+        stack.append(0.0)
+        begin = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            total = time.perf_counter() - begin
+            children = stack.pop()
+            if stack:
+                stack[-1] += total
+            if len(modules) != count:
+                # Something new was loaded
+                self.imports.append([self._name(name, globals, fromlist,
+                                                level),
+                                     self._current[0] if self._current
+                                     else None,
+                                     begin - self.start, total,
+                                     total - children])
+
+    @staticmethod
+    def _name(name, globals, fromlist, level):
+        """Full name of the module(s) an import statement loaded."""
+        if level:
+            package = (globals or {}).get('__package__') or ''
+            try:
+                name = importlib.util.resolve_name('.' * level + name,
+                                                   package)
+            except (ValueError, ImportError):
+                name = '.' * level + name
+        if fromlist:
+            subs = [x for x in fromlist if '%s.%s' % (name, x) in sys.modules]
+            if subs:
+                name = '%s.%s' % (name, ','.join(subs))
+        return name
+
+    def total(self):
+        """Time from start to the end of the last phase."""
+        ends = [end for name, begin, end in self.phases if end is not None]
+        return max(ends) if ends else self.now()
+
+    def overBudget(self, budget=None):
+        """True if startup took longer than budget seconds."""
+        return budget is not None and self.total() > budget
+
+    def toDict(self, budget=None):
+        total = self.total()
+        return {'total': total,
+                'budget': budget,
+                'overBudget': self.overBudget(budget),
+                'phases': [{'name': name, 'begin': begin,
+                            'time': (end if end is not None else total)
+                                    - begin}
+                           for name, begin, end in self.phases],
+                'imports': [{'name': name, 'phase': phase, 'begin': begin,
+                             'total': took, 'self': own}
+                            for name, phase, begin, took, own
+                            in self.imports],
+                }
+
+    def report(self, budget=None, format='text', top=25):
+        """Returns the timings as JSON, or as text with the slowest top
+           imports."""
+        if format == 'json':
+            return json.dumps(self.toDict(budget), indent=2)
+        total = self.total()
+        lines = ['Startup: %.3f seconds' % total, '',
+                 '%-28s %9s %9s' % ('Phase', 'Start(ms)', 'Time(ms)')]
+        for name, begin, end in self.phases:
+            lines.append('%-28s %9.1f %9.1f' % (
+                name, begin * 1000,
+                ((end if end is not None else total) - begin) * 1000))
+        if self.imports:
+            lines += ['', 'Slowest imports:',
+                      '%-40s %-20s %9s %9s' % ('Module', 'Phase',
+                                               'Total(ms)', 'Self(ms)')]
+            imports = sorted(self.imports, key=lambda x: x[4], reverse=True)
+            for name, phase, begin, took, own in imports[:top]:
+                lines.append('%-40s %-20s %9.1f %9.1f' % (
+                    name, phase, took * 1000, own * 1000))
+        if budget is not None:
+            lines.append('')
+            if self.overBudget(budget):
+                lines.append('OVER BUDGET: %.3f seconds, the budget is %.3f'
+                             % (total, budget))
+            else:
+                lines.append('Within the budget of %.3f seconds' % budget)
+        return '\n'.join(lines) + '\n'
+
+    def write(self, fileName, budget=None):
+        """Writes the report to fileName, or stdout if it's '-'.  JSON if the
+           name ends with '.json', otherwise text."""
+        if fileName == '-':
+            if sys.stdout is not None:
+                sys.stdout.write(self.report(budget))
+                sys.stdout.flush()
+            return
+        format = 'json' if fileName.lower().endswith('.json') else 'text'
+        with open(fileName, 'w') as out:
+            out.write(self.report(budget, format))
@@ -21,3 +21,22 @@
 
 
 """bolt contains utility functions and classes"""
+
+
+#--Sub-modules are only imported when first used, either by importing them
+#  directly or as attributes of the package (bolt.Path), so importing one of
+#  them doesn't load the rest.
+_submodules = ('Instrument', 'OneInstanceChecker', 'Optimize', 'Overlay',
+               'Path', 'Regex', 'Startup', 'Translations')
+
+
+def __getattr__(name):
+    if name not in _submodules:
+        raise AttributeError('module %r has no attribute %r'
+                             % (__name__, name))
+    import importlib
+    return importlib.import_module('.' + name, __name__)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules))
@@ -35,10 +35,18 @@ from . import bass
 
 def _OnExit():
     """Cleans out any temporary files or directories created by Bash."""
+    # Not in the background: this runs after the interpreter started shutting
+    # down, when no new threads can be started
     try:
         bass.dirs['temp'].remove()
     except Exception as e:
         pass
+    # Finish removing anything deleted in the background
+    Path.waitForRemovals()
+    try:
+        Path.crcCache.save()
+    except Exception as e:
+        pass
 
 
 def InitDirs():
@@ -62,6 +70,9 @@ def InitDirs():
     # appdata - User's Local App Data directory + Wrye Bash
     dirs['appdata'] = Path.LocalAppData.join('Wrye Bash')
 
+    # Load CRCs cached by previous runs.  Saved again by _OnExit.
+    Path.crcCache.load(dirs['appdata'].join('CRCs.json'))
+
     # temp - Wrye Bash's base directory for all temp files/folders this run
     dirs['temp'] = Path.makeTempdir(prefix='WryeBash_')
     # Now that our temp dir is created, register our cleanup function